@@ -59,4 +59,7 @@ setup(
         'Topic :: Utilities',
     ],
     platforms='any',
-    entry_points={'console_scripts': ['yatg=yatg:run_main']})
+    entry_points={
+        'console_scripts':
+        ['yatg=yatg:run_main', 'yatg-bench=yatg.bench:main']
+    })
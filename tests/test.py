@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import sys
 import tempfile
 import filecmp
+import subprocess
+import threading
 import unittest
 import emoji
 
@@ -22,6 +25,13 @@ def to_unicode(s):
     return s
 
 
+class TextBuffer(io.StringIO):
+    """ io.StringIO which also accepts str in python 2 """
+
+    def write(self, s):
+        return io.StringIO.write(self, to_unicode(s))
+
+
 class TestHtmlTableConverter(unittest.TestCase):
     def setUp(self):
         self.samples_path = os.path.join(
@@ -241,6 +251,24 @@ class TestHtmlTableConverter(unittest.TestCase):
             result, expect)
         self.assertEqual(result.rstrip(), expect.rstrip(), fail_msg)
 
+    def test_emoji_sequences(self):
+        # Whole emoji sequence is one character width with emoji width1 chars
+        force_width1_chars = list(yatg.FORCE_WIDTH1_CHARS)
+        yatg.FORCE_WIDTH1_CHARS[:] = ['emoji']
+        try:
+            for s, expected in [
+                (u"\U0001F44D\U0001F3FD", 1),  # skin tone modifier
+                (u"\U0001F468\u200D\U0001F469\u200D\U0001F467", 1),  # ZWJ
+                (u"\U0001F1FA\U0001F1F8", 1),  # flag
+                (u"\u2764\uFE0F", 1),  # variation selector
+                (u"a\U0001F1FA\U0001F1F8\U0001F1FA", 3),
+                (u"\u4e2d\U0001F600\u6587", 5),
+                (u"", 0),
+            ]:
+                self.assertEqual(yatg.yatg.compute_width(s, False), expected)
+        finally:
+            yatg.FORCE_WIDTH1_CHARS[:] = force_width1_chars
+
     def test_cmdline(self):
         _, tmpfn = tempfile.mkstemp()
         yatg.main_entry([
@@ -251,6 +279,704 @@ class TestHtmlTableConverter(unittest.TestCase):
         expfn = os.path.join(self.samples_path, "csv_simple.orgmode")
         self.assertTrue(filecmp.cmp(tmpfn, expfn))
 
+    def test_iter_ascii_table(self):
+        for file in os.listdir(self.samples_path):
+            if file.endswith('.html'):
+                fo = open(os.path.join(self.samples_path, file), "r")
+                data = fo.read()
+                fo.close()
+                for style in ['emacs', 'orgmode', 'mysql', 'markdown']:
+                    lines = list(yatg.iter_html_ascii_tables(data, style))
+                    for line in lines:
+                        self.assertTrue(line.endswith("\n"))
+                    self.assertEqual("".join(lines),
+                                     yatg.html_2_ascii_table(data, style))
+        lines = yatg.iter_csv_ascii_table([["head1", "head2"],
+                                           ["content1", "content2"]])
+        self.assertEqual(next(lines), "| head1    | head2    |\n")
+        self.assertEqual(list(lines), ["|----------+----------|\n",
+                                       "| content1 | content2 |\n"])
+
+    def test_big_html_table(self):
+        # Table is larger than 500 rows and 100 columns
+        rows = ["<tr>" + "".join("<td>%d</td>" % j for j in range(120)) +
+                "</tr>" for _ in range(600)]
+        data = "<table>" + "".join(rows) + "</table>"
+        result = yatg.html_2_ascii_table(data, 'mysql')
+        lines = result.splitlines()
+        self.assertEqual(len(lines), 600 + 3)
+        self.assertTrue(lines[-2].startswith("| 0 | 1 |"))
+        self.assertTrue(lines[-2].endswith("| 118 | 119 |"))
+
+    def test_expand_rowspan_heavy_table(self):
+        # 20k rows, there is a rowspan cell in every other row
+        table = []
+        for i in range(20000):
+            if i % 2 == 0:
+                table.append([
+                    yatg.yatg.MyTableCell("r%d" % i, "td", [("rowspan", "2")]),
+                    yatg.yatg.MyTableCell("a", "td"),
+                    yatg.yatg.MyTableCell("b", "td", [("colspan", "2")])
+                ])
+            else:
+                table.append([yatg.yatg.MyTableCell("c", "td")] * 3)
+        expanded = yatg.yatg.gen_expand_table(table)
+        self.assertEqual(len(expanded), 20000)
+        for i in (0, 1, 19998, 19999):
+            self.assertEqual(len(expanded[i]), 4)
+        self.assertEqual(expanded[19998][0].data, "r19998")
+        self.assertIsNone(expanded[19999][0].data)
+        self.assertNotEqual(expanded[19999][0].span_id, 0)
+        self.assertEqual(expanded[19999][0].span_id,
+                         expanded[19998][0].span_id)
+        self.assertEqual([c.data for c in expanded[19999][1:]],
+                         ["c", "c", "c"])
+
+    def test_expand_rowspan_before_pending_cell(self):
+        # Row 3 has a rowspan in column 0 while column 1 is still held by the
+        # rowspan of row 2, and row 4 has fewer cells than other rows. Cells
+        # below the rowspan of row 3 are in column 0, f is in column 2.
+        html = ("<table><tr><th>h1</th><th>h2</th><th>h3</th></tr>"
+                "<tr><td>a</td><td rowspan=3>b</td><td>c</td></tr>"
+                "<tr><td rowspan=2>d</td><td>e</td></tr>"
+                "<tr><td>f</td></tr></table>")
+        self.assertEqual(
+            yatg.html_2_ascii_table(html, 'mysql'),
+            "+----+----+----+\n"
+            "| h1 | h2 | h3 |\n"
+            "+----+----+----+\n"
+            "| a  | b  | c  |\n"
+            "| d  |    | e  |\n"
+            "|    |    | f  |\n"
+            "+----+----+----+\n")
+
+    def test_width_cache(self):
+        cache = yatg.WidthCache(maxsize=2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)  # "b" is least recently used, it's evicted
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.cache_info(), {
+            'hits': 1, 'misses': 2, 'maxsize': 2, 'currsize': 2})
+
+        yatg.WIDTH_CACHE.clear()
+        yatg.csv_2_ascii_table([["a", to_unicode("中文")], ["a", "b"],
+                                ["a", to_unicode("中文")]])
+        # ASCII strings are not cached
+        info = yatg.WIDTH_CACHE.cache_info()
+        self.assertEqual((info['misses'], info['currsize']), (1, 1))
+        self.assertTrue(info['hits'] > 0)
+
+    def test_str_width(self):
+        self.assertEqual(yatg.yatg.str_width(to_unicode("abc")), 3)
+        self.assertEqual(yatg.yatg.str_width(to_unicode("中文abc")), 7)
+        self.assertEqual(yatg.yatg.str_width(to_unicode("ｆｕｌｌ")), 8)
+        self.assertEqual(yatg.yatg.str_width(to_unicode("“”‘’")), 4)
+        # combining acute accent is drawn over previous char
+        self.assertEqual(yatg.yatg.str_width(u"e\u0301"), 1)
+
+    def test_render_to(self):
+        data = [["head1", to_unicode("中文")], ["content1", "content2"]]
+        expect = yatg.csv_2_ascii_table(data, output_style='mysql')
+        binary = io.BytesIO()
+        num_lines = yatg.render_to(
+            binary, yatg.iter_csv_ascii_table(data, output_style='mysql'))
+        self.assertEqual(num_lines, 5)
+        self.assertEqual(binary.getvalue(), expect.encode('utf-8'))
+        text = TextBuffer()
+        yatg.render_to(text, yatg.iter_csv_ascii_table(data,
+                                                       output_style='mysql'))
+        self.assertEqual(text.getvalue(), expect)
+
+    def test_term_width_session(self):
+        import contextlib
+
+        class FakeTerm(object):
+            """ Fake terminal, each char is rendered as width 2 """
+            is_a_tty = True
+            width = 80
+            height = 24
+
+            def __init__(self):
+                self.column = 0
+                self.num_get_location = 0
+                self.stream = self
+
+            def write(self, s):
+                self.column += 2 * len(s.replace('\b \b', ''))
+                self.column -= s.count('\b \b')
+
+            def flush(self):
+                pass
+
+            def cbreak(self):
+                return contextlib.contextmanager(lambda: iter([None]))()
+
+            def location(self, x, y):
+                return self.cbreak()
+
+            def get_location(self, timeout):
+                self.num_get_location += 1
+                return 0, self.column
+
+        session = yatg.yatg.TermWidthSession.__new__(
+            yatg.yatg.TermWidthSession)
+        session.term = FakeTerm()
+        strings = [to_unicode(x) for x in ["ab", "中文", "ab", "中文", "表"]]
+        result = session.measure(strings)
+        self.assertEqual(result, {strings[0]: 2, strings[1]: 4, strings[4]: 2})
+        # 1 for initial position, 1 for each non-ASCII string
+        self.assertEqual(session.term.num_get_location, 3)
+        # Cells of csv are measured in one batch too
+        session.term = FakeTerm()
+        optional_modules = dict(yatg.yatg._OPTIONAL_MODULES)
+        yatg.yatg._OPTIONAL_MODULES['blessed'] = session
+        yatg.yatg._TERM_WIDTH_SESSION[:] = [session]
+        try:
+            # rows rather than csv text, csv module of python 2 can not read
+            # non-ASCII unicode
+            output = yatg.csv_2_ascii_table(
+                [[u"h1", u"h2"]] + [[u"\u4e00%d" % i, u"x"] for i in range(10)],
+                align_in_tty=True)
+        finally:
+            yatg.yatg._OPTIONAL_MODULES.clear()
+            yatg.yatg._OPTIONAL_MODULES.update(optional_modules)
+            del yatg.yatg._TERM_WIDTH_SESSION[:]
+        self.assertEqual(session.term.num_get_location, 11)
+        self.assertIn(u"| \u4e000 | x  |", output)
+
+    def test_html_tables_in_workers(self):
+        data = ""
+        for file in sorted(os.listdir(self.samples_path)):
+            if file.endswith('.html'):
+                fo = open(os.path.join(self.samples_path, file), "r")
+                data += fo.read()
+                fo.close()
+        expect_stats = yatg.ConversionStats(trace_memory=False)
+        expect = yatg.html_2_ascii_table(data, 'emacs', stats=expect_stats)
+        consumed = []
+
+        def chunks():
+            for i in range(50):
+                consumed.append(i)
+                yield "<table><tr><td>%d</td></tr></table>" % i
+
+        stats = yatg.ConversionStats(trace_memory=False)
+        min_cells = yatg.yatg.PARALLEL_MIN_CELLS
+        yatg.yatg.PARALLEL_MIN_CELLS = 0  # force using pool for small input
+        try:
+            result = yatg.html_2_ascii_table(data, 'emacs', workers=2,
+                                             stats=stats)
+            lines = yatg.iter_html_ascii_tables(chunks(), workers=2)
+            first_line = next(lines)
+            consumed_ahead = len(consumed)
+            lines.close()
+        finally:
+            yatg.yatg.PARALLEL_MIN_CELLS = min_cells
+        self.assertEqual(result, expect)
+        # width() calls in workers are counted
+        self.assertEqual(stats.width_calls, expect_stats.width_calls)
+        # Input is parsed only a few tables ahead of output
+        self.assertEqual(first_line, "| 0 |\n")
+        self.assertLess(consumed_ahead, 10)
+
+    def test_html_tables_from_chunks(self):
+        consumed = []
+
+        def chunks():
+            for i in range(3):
+                for chunk in ["<table><tr><td>t", str(i), "</td></tr></t",
+                              "able>"]:
+                    consumed.append(chunk)
+                    yield chunk
+
+        lines = yatg.iter_html_ascii_tables(chunks(), 'mysql')
+        self.assertEqual(next(lines), "+----+\n")
+        self.assertEqual(len(consumed), 4)  # only first table is read
+        self.assertEqual("".join(lines), "| t0 |\n+----+\n\n"
+                         "+----+\n| t1 |\n+----+\n\n"
+                         "+----+\n| t2 |\n+----+\n")
+
+    def test_width_sample(self):
+        csv_path = os.path.join(self.samples_path, "csv_simple.csv")
+        fo = open(csv_path, "r")
+        data = fo.read()
+        fo.close()
+        for style in ['emacs', 'orgmode', 'mysql', 'markdown']:
+            # Sample covers all rows, output is same as exact width
+            self.assertEqual(
+                yatg.csv_2_ascii_table(data, ',', style, width_sample=1000),
+                yatg.csv_2_ascii_table(data, ',', style))
+        rows = [["head1", "head2"], ["a|b", "c"], ["too long", "d"]]
+        self.assertEqual(
+            yatg.csv_2_ascii_table(rows, output_style='mysql',
+                                   width_sample=2, overflow='truncate'),
+            "+-------+-------+\n"
+            "| head1 | head2 |\n"
+            "+-------+-------+\n"
+            "| a|b   | c     |\n"
+            "| too ~ | d     |\n"
+            "+-------+-------+\n")
+        rows[2][0] = "much too long"
+        self.assertEqual(
+            yatg.csv_2_ascii_table(rows, output_style='orgmode',
+                                   width_sample=2, overflow='stretch'),
+            "| head1      | head2 |\n"
+            "|------------+-------|\n"
+            "| a\\vertb    | c     |\n"
+            "| much too long | d     |\n")
+
+    def test_column_widths(self):
+        rows = [["head1", "head2"],
+                ["a very long cell", to_unicode("中文中文")]]
+        lines = yatg.iter_csv_ascii_table(rows, output_style='emacs',
+                                          column_widths=[6, 5])
+        self.assertEqual(list(lines), [
+            "+--------+-------+\n",
+            "| head1  | head2 |\n",
+            "+--------+-------+\n",
+            "| a ver~ | " + to_unicode("中文") + "~ |\n",
+            "+--------+-------+\n",
+        ])
+
+    def test_csv_layout_validation(self):
+        rows = [["head1", "head2"], ["a", "b"]]
+        for kwargs in ({'width_sample': 0}, {'column_widths': [3, -1]},
+                       {'column_widths': []}, {'overflow': 'wrap'}):
+            self.assertRaises(ValueError, yatg.iter_csv_ascii_table, rows,
+                              **kwargs)
+        # They are rejected by command line for html input
+        options = dict(yatg.yatg.DEFAULT_OPTIONS, input_format='html',
+                       width_sample=2)
+        errors = TextBuffer()
+        exit_code = yatg.yatg.convert_cli(
+            options, io.StringIO(u"<table><tr><td>a</td></tr></table>"), None,
+            io.BytesIO(), errors)
+        self.assertEqual(exit_code, 1)
+        self.assertIn("only supported for csv input", errors.getvalue())
+
+    def test_column_widths_from_pipe(self):
+        # Rows are output before input is closed
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import yatg; yatg.run_main()', '-f', 'csv',
+             '-d', ',', '--column-widths', '3,3'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=file_path)
+        lines = []
+        reader = threading.Thread(
+            target=lambda: lines.extend(
+                process.stdout.readline() for _ in range(3)))
+        reader.start()
+        process.stdin.write(b"a,b\n1,2\n")
+        process.stdin.flush()
+        reader.join(10)
+        received = list(lines)
+        process.stdin.close()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        self.assertEqual(received, [b"| a   | b   |\n", b"|-----+-----|\n",
+                                    b"| 1   | 2   |\n"])
+
+    def test_html_tables_from_pipe(self):
+        # Each table is output before input is closed
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import yatg; yatg.run_main()', '-f',
+             'html'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=file_path)
+        lines = []
+        reader = threading.Thread(
+            target=lambda: lines.extend(
+                process.stdout.readline() for _ in range(3)))
+        reader.start()
+        process.stdin.write(b"<html>\n<table><tr><th>a</th></tr>"
+                            b"<tr><td>1</td></tr></table>\n")
+        process.stdin.flush()
+        reader.join(10)
+        received = list(lines)
+        process.stdin.write(b"<table><tr><td>2</td></tr></table>\n")
+        process.stdin.close()
+        output = process.stdout.read()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        self.assertEqual(received, [b"| a |\n", b"|---|\n", b"| 1 |\n"])
+        self.assertEqual(output, b"\n| 2 |\n")
+
+    def test_csv_from_file_object(self):
+        # Quoted field contains newline, it should not be split into 2 rows
+        csv_content = 'h1,h2\r\n"x\ny",1\r\n2,3\r\n'
+        expected = yatg.csv_2_ascii_table(csv_content)
+        self.assertEqual(expected.count("\n"), 5)
+        output = yatg.csv_2_ascii_table(io.StringIO(to_unicode(csv_content)))
+        self.assertEqual(output, expected)
+        # Rows with different length are padded
+        output = yatg.csv_2_ascii_table(io.StringIO(to_unicode("1,2\nA,B,C")),
+                                        output_style='mysql')
+        self.assertIn("| 1 | 2 |   |", output)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires 3.7+")
+    def test_import_time(self):
+        # Optional packages, csv and html.parser are imported on first use,
+        # and logging is not configured when yatg is imported
+        code = ("import logging, yatg; yatg.csv_2_ascii_table; "
+                "assert not logging.getLogger().handlers")
+        output = subprocess.check_output(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stderr=subprocess.STDOUT, cwd=file_path).decode('utf-8')
+        imported = [line.split('|')[-1].strip() for line in output.splitlines()
+                    if line.startswith('import time:')]
+        self.assertIn('yatg.yatg', imported)
+        for name in ('emoji', 'blessed', 'csv', 'html.parser'):
+            self.assertNotIn(name, imported)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "yatg is imported eagerly")
+    def test_client_import_time(self):
+        # The thin client does not import yatg.yatg
+        code = "import yatg.client"
+        output = subprocess.check_output(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stderr=subprocess.STDOUT, cwd=file_path).decode('utf-8')
+        imported = [line.split('|')[-1].strip() for line in output.splitlines()
+                    if line.startswith('import time:')]
+        self.assertIn('yatg.client', imported)
+        self.assertNotIn('yatg.yatg', imported)
+
+    def test_bench(self):
+        from yatg import bench
+        result = bench.run(workloads=['spans-high'], repeat=1, scale=0.01,
+                           startup=False)
+        stages = set((r['input'], r['style'], r['stage'])
+                     for r in result['results'])
+        self.assertIn(('html', None, 'gen_expand_table'), stages)
+        self.assertIn(('csv', 'emacs', 'iter_plain_table_lines'), stages)
+        self.assertIn(('html', 'markdown', 'output_other_table'), stages)
+        self.assertEqual(len(stages), 3 + 2 * 4 * 2)
+        self.assertTrue(all(r['seconds'] >= 0 for r in result['results']))
+
+    def test_conversion_stats(self):
+        csv_content = "head1,head2\ncontent1,content2\n"
+        expected = yatg.csv_2_ascii_table(csv_content)
+        stats = yatg.ConversionStats()
+        output = yatg.csv_2_ascii_table(csv_content, stats=stats)
+        self.assertEqual(output, expected)
+        self.assertEqual(set(stats.stages), set(['parse', 'width', 'render']))
+        self.assertEqual((stats.tables, stats.cells), (1, 4))
+        self.assertEqual(stats.width_calls, 4)
+        self.assertEqual(stats.bytes_in, len(csv_content))
+        self.assertEqual(stats.bytes_out, len(output))
+        if sys.version_info[0] >= 3:
+            self.assertTrue(stats.peak_memory > 0)
+        # Counters of interleaved conversions are not mixed
+        stats_a, stats_b = yatg.ConversionStats(), yatg.ConversionStats()
+        lines_a = yatg.iter_csv_ascii_table("a,b\n1,2\n", stats=stats_a)
+        lines_b = yatg.iter_csv_ascii_table("a,b,c\n1,2,3\n", stats=stats_b)
+        for _ in zip(lines_a, lines_b):
+            pass
+        list(lines_a)
+        list(lines_b)
+        self.assertEqual((stats_a.width_calls, stats_b.width_calls), (4, 6))
+        # stats can be a callback
+        collected = []
+        with open(os.path.join(self.samples_path, 'basic.html')) as f:
+            yatg.html_2_ascii_table(f, stats=collected.append)
+        self.assertEqual(len(collected), 1)
+        self.assertEqual(list(collected[0].stages),
+                         ['parse', 'expand', 'width', 'render'])
+        self.assertEqual(collected[0].cells, 6)
+        self.assertIn("cells: 6", collected[0].report())
+
+    def test_register_renderer(self):
+        class BoxRenderer(yatg.TableRenderer):
+            name = 'box'
+            escaped_vert_bar = '!'
+            top = bottom = ('+', '-', '+')
+            header = ('|', '+', '|')
+
+        yatg.register_renderer(BoxRenderer())
+        try:
+            output = yatg.csv_2_ascii_table("h1,h2\na|b,c\n",
+                                            output_style='box')
+        finally:
+            yatg.unregister_renderer('box')
+        self.assertNotIn('box', yatg.RENDERERS)
+        self.assertEqual(
+            output, "+-----------+\n"
+            "| h1   | h2 |\n"
+            "|------+----|\n"
+            "| a!b  | c  |\n"
+            "+-----------+\n")
+        # Compiled layout is reused by tables with same widths
+        renderer = yatg.RENDERERS['orgmode']
+        self.assertIs(renderer.compile([3, 2], 'rl'),
+                      renderer.compile([3, 2], 'rl'))
+
+    def test_daemon(self):
+        from yatg import client
+        socket_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(socket_dir, 'yatg.sock')
+        output_path = os.path.join(socket_dir, 'out.txt')
+        server = yatg.yatg.gen_conversion_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        results = {}
+
+        def run_client(argv, input_data=b"h1,h2\n1,2\n"):
+            output = io.BytesIO()
+            errors = TextBuffer()
+            code = client.main(['yatg', '--client', socket_path] + argv,
+                               io.BytesIO(input_data), output, errors)
+            return code, output.getvalue(), errors.getvalue()
+
+        def convert(i):
+            input_data = (u"h1,h2\n%d,\u4e2d\n" % i).encode('utf-8')
+            code, output, _ = run_client(['-s', 'mysql', '-d', ','],
+                                         input_data)
+            results[i] = (code, output.decode('utf-8'))
+
+        try:
+            clients = [
+                threading.Thread(target=convert, args=(i, ))
+                for i in range(8)
+            ]
+            for client_thread in clients:
+                client_thread.start()
+            for client_thread in clients:
+                client_thread.join()
+            # Output file is not written if the conversion fails
+            failed = run_client(['--column-align', 'x', '-o', output_path])
+            output_exists = os.path.exists(output_path)
+            client_results = []
+            for argv in (['-s', 'mysql'], ['-s', 'x'], ['--version'],
+                         ['-i', 'a.csv', '-i', 'b.csv']):
+                client_results.append(run_client(argv))
+            written = run_client(['-s', 'mysql', '-o', output_path])
+            with open(output_path, 'rb') as f:
+                output_data = f.read()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.unlink(socket_path)
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+            os.rmdir(socket_dir)
+        for i in range(8):
+            # rows rather than csv text, csv module of python 2 can not read
+            # non-ASCII unicode
+            rows = [[u"h1", u"h2"], [u"%d" % i, u"\u4e2d"]]
+            self.assertEqual(
+                results[i],
+                (0, yatg.csv_2_ascii_table(rows, output_style='mysql')))
+        self.assertEqual(failed[0], 1)
+        self.assertIn("--column-align is not valid", failed[2])
+        self.assertFalse(output_exists)
+        expected = yatg.csv_2_ascii_table(u"h1,h2\n1,2\n",
+                                          output_style='mysql').encode('utf-8')
+        self.assertEqual(client_results[0][:2], (0, expected))
+        self.assertEqual(client_results[1][0], 2)
+        self.assertIn("invalid choice", client_results[1][2])
+        self.assertEqual(client_results[2][0], 0)
+        self.assertIn(yatg.__version__, client_results[2][2])
+        self.assertNotIn("read data from stdin", client_results[2][2])
+        self.assertEqual(client_results[3][0], 2)
+        self.assertIn("multiple input files", client_results[3][2])
+        self.assertEqual(written[:2], (0, b''))
+        self.assertEqual(output_data, expected)
+
+    def test_daemon_concurrent_requests(self):
+        import time
+        from yatg import client
+        socket_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(socket_dir, 'yatg.sock')
+        server = yatg.yatg.gen_conversion_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        finished = []
+
+        def convert(name, input_file):
+            code = client.main(['yatg', '--client', socket_path, '-d', ','],
+                               input_file, io.BytesIO(), TextBuffer())
+            finished.append((name, code))
+
+        rows = u"".join(u"%d,\u4e2d%d\n" % (i, i) for i in range(100000))
+        large = io.BytesIO((u"h1,h2\n" + rows).encode('utf-8'))
+        large_client = threading.Thread(target=convert, args=('large', large))
+        misses = yatg.WIDTH_CACHE.misses
+        try:
+            large_client.start()
+            # Each cell of the large request misses in WIDTH_CACHE once its
+            # conversion is started
+            deadline = time.time() + 30
+            while yatg.WIDTH_CACHE.misses == misses and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+            # The small request is converted while the large one is running,
+            # rather than waiting for it
+            convert('small', io.BytesIO(b"h1,h2\n1,2\n"))
+            large_misses = yatg.WIDTH_CACHE.misses - misses
+            large_client.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.unlink(socket_path)
+            os.rmdir(socket_dir)
+        self.assertLess(large_misses, 100000)
+        self.assertEqual(finished, [('small', 0), ('large', 0)])
+
+    def test_batch(self):
+        import shutil
+        input_dir = tempfile.mkdtemp()
+        output_dir = os.path.join(input_dir, 'out')
+        inputs = {
+            'a.csv': b"h1,h2\n1,2\n",
+            'b.csv': b"h1;h2\n3;4\n",
+            'c.csv': b"x,y\n",
+            'c.html': b"<table><tr><th>h</th></tr><tr><td>5</td></tr></table>",
+            'd.csv': b"\xff\xfe",
+        }
+        for name, data in inputs.items():
+            with open(os.path.join(input_dir, name), 'wb') as f:
+                f.write(data)
+        options = dict(yatg.yatg.DEFAULT_OPTIONS, jobs=2)
+        errors = yatg.yatg.MessageBuffer()
+        try:
+            exit_code = yatg.yatg.convert_batch(options, [input_dir],
+                                                output_dir, '.{style}.txt',
+                                                errors)
+            outputs = {}
+            for name in sorted(os.listdir(output_dir)):
+                with open(os.path.join(output_dir, name), 'rb') as f:
+                    outputs[name] = f.read().decode('utf-8')
+            # Outputs beside inputs are not inputs of next run
+            rerun_errors = []
+            for _ in range(2):
+                rerun_errors.append(yatg.yatg.MessageBuffer())
+                yatg.yatg.convert_batch(options, [input_dir], None, '.txt',
+                                        rerun_errors[-1])
+            # Invalid option is reported once, rather than for each file
+            invalid_errors = yatg.yatg.MessageBuffer()
+            invalid_exit_code = yatg.yatg.convert_batch(
+                dict(options, column_align='x'), [input_dir],
+                os.path.join(input_dir, 'invalid'), None, invalid_errors)
+            invalid_output = os.path.exists(os.path.join(input_dir,
+                                                         'invalid'))
+        finally:
+            shutil.rmtree(input_dir)
+        # Failed files do not stop others
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(
+            outputs, {
+                'a.orgmode.txt': yatg.csv_2_ascii_table("h1,h2\n1,2\n"),
+                'b.orgmode.txt': yatg.csv_2_ascii_table("h1,h2\n3,4\n"),
+                'c.orgmode.txt': yatg.csv_2_ascii_table("x,y\n"),
+            })
+        messages = errors.getvalue()
+        self.assertIn(os.path.join(input_dir, 'd.csv') + ": Error:", messages)
+        self.assertIn(os.path.join(input_dir, 'c.html') + ": Error: output",
+                      messages)
+        self.assertIn("converted 5 files, 2 failed", messages)
+        self.assertIn("converted 5 files, 2 failed",
+                      rerun_errors[1].getvalue())
+        self.assertEqual(invalid_exit_code, 1)
+        self.assertEqual(invalid_errors.getvalue(),
+                         "--column-align is not valid, only l/r is "
+                         "supported.\n")
+        self.assertFalse(invalid_output)
+
+    @unittest.skipIf(sys.version_info < (3, 6), "yatg.aio requires 3.6")
+    def test_async(self):
+        import asyncio
+        import concurrent.futures
+        from yatg import aio
+        csv = "h1,h2\n" + "".join("%d,x\n" % i for i in range(100))
+        loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        state = {'closed': False}
+
+        def endless_lines():
+            try:
+                while True:
+                    yield "x\n"
+            finally:
+                state['closed'] = True
+
+        try:
+            output = loop.run_until_complete(
+                aio.csv_2_ascii_table_async(csv, chunk_lines=7))
+            task = loop.create_task(
+                aio._join_lines(aio.aiter_lines(endless_lines(), 10, executor)))
+            loop.run_until_complete(asyncio.sleep(0.05))
+            task.cancel()
+            loop.run_until_complete(asyncio.wait([task]))
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+        self.assertEqual(output, yatg.csv_2_ascii_table(csv))
+        self.assertTrue(task.cancelled())
+        self.assertTrue(state['closed'])
+
+    def test_array_input(self):
+        try:
+            import numpy
+            import pandas
+        except ImportError:
+            self.skipTest("numpy or pandas is not installed")
+        rows = [[u"id", u"name|alias"], [u"1", u"\u4e2d\u6587"],
+                [u"22", u"x|y|z"]]
+        for style in yatg.RENDERERS:
+            expected = yatg.csv_2_ascii_table(rows, output_style=style,
+                                              column_align='rl')
+            self.assertEqual(
+                yatg.csv_2_ascii_table(numpy.array(rows), output_style=style,
+                                       column_align='rl'), expected)
+            data_frame = pandas.DataFrame(rows[1:], columns=rows[0])
+            self.assertEqual(
+                yatg.csv_2_ascii_table(data_frame, output_style=style,
+                                       column_align='rl'), expected)
+        # Values are converted by str(), header is names of columns
+        data_frame = pandas.DataFrame({'a': [1, 2], 'b': [0.5, None]})
+        self.assertEqual(
+            yatg.csv_2_ascii_table(data_frame), "| a | b   |\n"
+            "|---+-----|\n"
+            "| 1 | 0.5 |\n"
+            "| 2 | nan |\n")
+
+    def test_iterable_rows(self):
+        import csv
+        import sqlite3
+        expected = yatg.csv_2_ascii_table("id,name\n1,a\n2,\n")
+        rows = [("id", "name"), ("1", "a"), ("2", "")]
+        self.assertEqual(yatg.csv_2_ascii_table(row for row in rows),
+                         expected)
+        self.assertEqual(
+            yatg.csv_2_ascii_table(csv.reader(["id,name", "1,a", "2,"])),
+            expected)
+        # Values which are not strings are converted by str()
+        connection = sqlite3.connect(':memory:')
+        cursor = connection.execute(
+            "select 'id', 'name' union all select 1, 'a' union all "
+            "select 2, ''")
+        self.assertEqual(yatg.csv_2_ascii_table(cursor), expected)
+        connection.close()
+        # Short rows are padded with empty cells
+        self.assertEqual(
+            yatg.csv_2_ascii_table(iter([["id", "name"], ["1", "a"], [2]])),
+            expected)
+        # Lines of csv, bytes and dicts (e.g. rows of csv.DictReader) are not
+        # rows
+        import csv
+        for content in (["id,name", "1,a"], iter(["id,name", "1,a"]),
+                        [b"id,name", b"1,a"],
+                        csv.DictReader(io.StringIO(u"id,name\n1,a\n"))):
+            with self.assertRaises(Exception) as context:
+                yatg.csv_2_ascii_table(content)
+            self.assertIn("sequence of cell values", str(context.exception))
+
 
 if __name__ == '__main__':
     unittest.main()
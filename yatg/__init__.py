@@ -5,11 +5,44 @@ A utility for generating ASCII art table.
 Input data can be CSV or html, supports multiple output styles: orgmode, emacs,
 mysql, markdown.
 """
-from .yatg import html_2_ascii_table, csv_2_ascii_table, FORCE_WIDTH1_CHARS, \
-    main_entry, __author__, __version__, __email__, __source__, __license__
-
 import sys
 
+# Names re-exported from yatg.yatg
+_EXPORTS = ('html_2_ascii_table', 'csv_2_ascii_table', 'iter_html_ascii_tables',
+            'iter_csv_ascii_table', 'render_to', 'FORCE_WIDTH1_CHARS',
+            'WIDTH_CACHE', 'WidthCache', 'ConversionStats', 'TableRenderer',
+            'register_renderer', 'unregister_renderer', 'RENDERERS',
+            'main_entry', '__author__', '__version__', '__email__',
+            '__source__', '__license__')
+
+if sys.version_info >= (3, 7):
+    # Import yatg.yatg on first access, so that the thin client (yatg.client)
+    # does not import it
+    def __getattr__(name):
+        if name in _EXPORTS or name == 'yatg':
+            __import__(__name__ + '.yatg')
+            module = sys.modules[__name__ + '.yatg']
+            return module if name == 'yatg' else getattr(module, name)
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(
+            __name__, name))
+else:
+    from .yatg import html_2_ascii_table, csv_2_ascii_table, \
+        iter_html_ascii_tables, iter_csv_ascii_table, render_to, \
+        FORCE_WIDTH1_CHARS, WIDTH_CACHE, WidthCache, ConversionStats, \
+        TableRenderer, register_renderer, unregister_renderer, RENDERERS, \
+        main_entry, __author__, __version__, __email__, __source__, \
+        __license__
+
+
+def is_client_argv(argv):
+    """ Return True if command line arguments argv contain --client """
+    return any(arg == '--client' or arg.startswith('--client=')
+               for arg in argv[1:])
+
 
 def run_main():
+    if is_client_argv(sys.argv):
+        from .client import main
+        sys.exit(main(sys.argv))
+    from .yatg import main_entry
     main_entry(sys.argv)
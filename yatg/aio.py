@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+""" Asyncio API of yatg, it requires Python 3.6 or later.
+
+The conversion is run in an executor chunk by chunk, so the event loop is
+not blocked while a large table is rendered, and it gets control back
+between chunks. Cancelling the awaiting task stops the conversion after the
+chunk which is being rendered.
+
+Example::
+
+  >>> from yatg.aio import csv_2_ascii_table_async
+  >>> table = await csv_2_ascii_table_async("h1,h2\\n1,2\\n")
+"""
+
+import asyncio
+import threading
+
+from . import yatg
+
+# Number of lines rendered by each call in executor
+CHUNK_LINES = 256
+
+# asyncio.get_running_loop is added in Python 3.7
+_get_running_loop = getattr(asyncio, 'get_running_loop',
+                            asyncio.get_event_loop)
+
+
+class _ChunkState(object):
+    """ State shared by event loop and executor, the executor closes lines
+    when the conversion is cancelled while it's rendering a chunk. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.cancelled = False
+
+
+def _next_chunk(lines, chunk_lines, state):
+    """ Generate at most chunk_lines lines, return them as a list. It runs in
+    executor. """
+    chunk = []
+    try:
+        for line in ([] if state.cancelled else lines):
+            chunk.append(line)
+            if len(chunk) >= chunk_lines or state.cancelled:
+                break
+    finally:
+        with state.lock:
+            state.running = False
+            if state.cancelled:
+                lines.close()
+    return chunk
+
+
+async def aiter_lines(lines, chunk_lines=CHUNK_LINES, executor=None):
+    """ Generate lines of generator lines asynchronously, lines are generated
+    in executor chunk by chunk. lines is closed when the iteration stops.
+
+    Arguments:
+      lines: Generator of lines, e.g. returned by iter_csv_ascii_table.
+      chunk_lines: Number of lines generated by each call in executor.
+      executor: concurrent.futures.ThreadPoolExecutor, default executor of
+                event loop is used if it's None. Generators can not be sent
+                to processes, so a process pool is not supported.
+
+    Returns:
+      Asynchronous generator of lines
+    """
+    loop = _get_running_loop()
+    state = _ChunkState()
+    try:
+        while True:
+            state.running = True
+            # Shielded, so that a chunk queued in executor still runs after
+            # cancellation, and it closes lines
+            chunk = await asyncio.shield(
+                loop.run_in_executor(executor, _next_chunk, lines,
+                                     chunk_lines, state))
+            if not chunk:
+                return
+            for line in chunk:
+                yield line
+    finally:
+        with state.lock:
+            state.cancelled = True
+            running = state.running
+        if not running:  # otherwise it's closed by executor
+            lines.close()
+
+
+def iter_csv_ascii_table_async(csv_content,
+                               csv_delimiter=',',
+                               output_style='orgmode',
+                               column_align=None,
+                               no_header=False,
+                               align_in_tty=False,
+                               width_sample=None,
+                               overflow=None,
+                               column_widths=None,
+                               stats=None,
+                               chunk_lines=CHUNK_LINES,
+                               executor=None):
+    """ Asynchronous counterpart of iter_csv_ascii_table, see aiter_lines for
+    chunk_lines and executor.
+
+    Returns:
+      Asynchronous generator of lines, each line is ended with a newline
+    """
+    lines = yatg.iter_csv_ascii_table(csv_content, csv_delimiter,
+                                      output_style, column_align, no_header,
+                                      align_in_tty, width_sample, overflow,
+                                      column_widths, stats)
+    return aiter_lines(lines, chunk_lines, executor)
+
+
+def iter_html_ascii_tables_async(html_content,
+                                 output_style='orgmode',
+                                 column_align=None,
+                                 no_header=False,
+                                 align_in_tty=False,
+                                 workers=None,
+                                 stats=None,
+                                 chunk_lines=CHUNK_LINES,
+                                 executor=None):
+    """ Asynchronous counterpart of iter_html_ascii_tables, see aiter_lines
+    for chunk_lines and executor.
+
+    Returns:
+      Asynchronous generator of lines, each line is ended with a newline
+    """
+    lines = yatg.iter_html_ascii_tables(html_content, output_style,
+                                        column_align, no_header, align_in_tty,
+                                        workers, stats)
+    return aiter_lines(lines, chunk_lines, executor)
+
+
+async def _join_lines(lines):
+    chunks = []
+    async for line in lines:
+        chunks.append(line)
+    return "".join(chunks)
+
+
+async def csv_2_ascii_table_async(csv_content,
+                                  csv_delimiter=',',
+                                  output_style='orgmode',
+                                  column_align=None,
+                                  no_header=False,
+                                  align_in_tty=False,
+                                  width_sample=None,
+                                  overflow=None,
+                                  column_widths=None,
+                                  stats=None,
+                                  chunk_lines=CHUNK_LINES,
+                                  executor=None):
+    """ Asynchronous counterpart of csv_2_ascii_table, see aiter_lines for
+    chunk_lines and executor.
+
+    Returns:
+      Ascii table
+    """
+    return await _join_lines(
+        iter_csv_ascii_table_async(csv_content, csv_delimiter, output_style,
+                                   column_align, no_header, align_in_tty,
+                                   width_sample, overflow, column_widths,
+                                   stats, chunk_lines, executor))
+
+
+async def html_2_ascii_table_async(html_content,
+                                   output_style='orgmode',
+                                   column_align=None,
+                                   no_header=False,
+                                   align_in_tty=False,
+                                   workers=None,
+                                   stats=None,
+                                   chunk_lines=CHUNK_LINES,
+                                   executor=None):
+    """ Asynchronous counterpart of html_2_ascii_table, see aiter_lines for
+    chunk_lines and executor.
+
+    Returns:
+      Ascii table
+    """
+    return await _join_lines(
+        iter_html_ascii_tables_async(html_content, output_style, column_align,
+                                     no_header, align_in_tty, workers, stats,
+                                     chunk_lines, executor))
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmark of yatg. It generates synthetic csv and html tables, times each
+stage of the conversion separately for every output style, and prints the
+result as JSON, so results of different commits can be compared.
+
+Run `yatg-bench --help` (or `python -m yatg.bench --help`) for usage.
+"""
+
+from __future__ import print_function
+
+import array
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import yatg
+
+if sys.version_info[0] < 3:
+    unichr_ = unichr  # noqa: F821
+else:
+    unichr_ = chr
+
+try:
+    _timer = time.perf_counter
+except AttributeError:  # Python 2
+    _timer = time.time
+
+# Chars used to generate cell data of each charset
+CHARSETS = {
+    'ascii':
+    u'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ',
+    'cjk':
+    u''.join(unichr_(0x4e00 + i) for i in range(0, 2000, 20)),
+    'emoji':
+    u'ab1 ' + u''.join(unichr_(0x1f600 + i) for i in range(40)),
+}
+
+# Default workloads, each item is (name, parameters of gen_workload)
+WORKLOADS = [
+    ('ascii-short', dict(rows=2000, cols=10, span_density=0.0,
+                         charset='ascii', cell_len=8)),
+    ('ascii-long', dict(rows=400, cols=10, span_density=0.0,
+                        charset='ascii', cell_len=80)),
+    ('cjk-short', dict(rows=2000, cols=10, span_density=0.0,
+                       charset='cjk', cell_len=8)),
+    ('emoji-short', dict(rows=2000, cols=10, span_density=0.0,
+                         charset='emoji', cell_len=8)),
+    ('spans-low', dict(rows=2000, cols=10, span_density=0.1,
+                       charset='ascii', cell_len=8)),
+    ('spans-high', dict(rows=2000, cols=10, span_density=0.5,
+                        charset='ascii', cell_len=8)),
+]
+
+
+def gen_workload(rows, cols, span_density, charset, cell_len, seed=0):
+    """ Generate a synthetic table, return (csv_content, html_content).
+
+    Arguments:
+      rows, cols: Size of the table.
+      span_density: Probability that a cell of html table has colspan=2 or
+                    rowspan=2 (half of them each), csv table has no span.
+      charset: Key of CHARSETS, chars of cell data are chosen from it.
+      cell_len: Number of chars in each cell.
+      seed: Seed of random, same arguments generate same table.
+    """
+    rand = random.Random(seed)
+    chars = CHARSETS[charset]
+
+    def gen_cell():
+        return u''.join(rand.choice(chars) for _ in range(cell_len)).strip()
+
+    csv_lines = []
+    html_parts = [u'<table>\n']
+    occupied = set()  # cells covered by rowspan of above row
+    for i in range(rows):
+        cells = [gen_cell() for _ in range(cols)]
+        csv_lines.append(u','.join(cells))
+        tag = 'th' if i == 0 else 'td'
+        html_parts.append(u'<tr>')
+        j = 0
+        while j < cols:
+            if (i, j) in occupied:
+                j += 1
+                continue
+            attrs = u''
+            if i > 0 and rand.random() < span_density:
+                if rand.random() < 0.5 and j + 1 < cols and \
+                        (i, j + 1) not in occupied:
+                    attrs = u' colspan="2"'
+                    j += 1
+                elif i + 1 < rows:
+                    attrs = u' rowspan="2"'
+                    occupied.add((i + 1, j))
+            html_parts.append(u'<%s%s>%s</%s>' % (tag, attrs, cells[j], tag))
+            j += 1
+        html_parts.append(u'</tr>\n')
+    html_parts.append(u'</table>\n')
+    return u'\n'.join(csv_lines) + u'\n', u''.join(html_parts)
+
+
+def time_call(func, repeat, setup=None):
+    """ Call func repeat times, return (best seconds, result of last call).
+    setup is called before each call and is not timed. """
+    best = None
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = _timer()
+        result = func()
+        elapsed = _timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def parse_html(html_content):
+    """ Parse html_content with MyHTMLParser, return the first table. """
+    parser = yatg.get_html_parser_class()()
+    parser.feed(html_content)
+    parser.close()
+    return parser.tables[0]
+
+
+def gen_plain_cells_width(rows, style):
+    """ Compute width of columns of csv rows as csv_2_ascii_table does, return
+    width of each cell. """
+    cells_width = array.array('i')
+    yatg.gen_plain_cols_width(rows, style, False, cells_width)
+    return cells_width
+
+
+def bench_workload(name, params, repeat, seed=0, styles=None):
+    """ Benchmark one workload, return list of result records. """
+    csv_content, html_content = gen_workload(seed=seed, **params)
+    records = []
+
+    def record(input_format, style, stage, seconds, table):
+        records.append({
+            'workload': name,
+            'params': params,
+            'input': input_format,
+            'style': style,
+            'stage': stage,
+            'seconds': seconds,
+            'cells': sum(len(row) for row in table),
+        })
+
+    seconds, csv_rows = time_call(
+        lambda: list(yatg.iter_csv_rows(csv_content, ',')), repeat)
+    record('csv', None, 'iter_csv_rows', seconds, csv_rows)
+    seconds, html_table = time_call(lambda: parse_html(html_content), repeat)
+    record('html', None, 'MyHTMLParser', seconds, html_table)
+    seconds, expand_table = time_call(
+        lambda: yatg.gen_expand_table(html_table), repeat)
+    record('html', None, 'gen_expand_table', seconds, expand_table)
+
+    for style in styles or list(yatg.RENDERERS):
+        # Width cache is cleared, otherwise only the first run measures width
+        # of cells
+        seconds, cells_width = time_call(
+            lambda: gen_plain_cells_width(csv_rows, style), repeat,
+            setup=yatg.WIDTH_CACHE.clear)
+        record('csv', style, 'gen_plain_cols_width', seconds, csv_rows)
+        cols_width = yatg.gen_plain_cols_width(csv_rows, style, False)
+        seconds, _ = time_call(
+            lambda: list(yatg.iter_plain_table_lines(
+                csv_rows, cols_width, style, None, False, False, 'stretch',
+                cells_width)), repeat)
+        record('csv', style, 'iter_plain_table_lines', seconds, csv_rows)
+
+        table = expand_table
+        seconds, cols_width = time_call(
+            lambda: yatg.gen_output_cols_width(table, style, False), repeat,
+            setup=yatg.WIDTH_CACHE.clear)
+        record('html', style, 'gen_output_cols_width', seconds, table)
+        metrics = yatg.gen_cell_metrics(table, style, False)
+        if style == 'emacs':
+            stage = 'output_emacs_table'
+            render = lambda: yatg.output_emacs_table(table, cols_width, None,
+                                                     False, metrics)
+        else:
+            stage = 'output_other_table'
+            render = lambda: yatg.output_other_table(
+                table, cols_width, style, None, False, False, metrics)
+        seconds, _ = time_call(render, repeat)
+        record('html', style, stage, seconds, table)
+    return records
+
+
+def bench_startup(repeat):
+    """ Time `import yatg.yatg` in a new interpreter with `python -X
+    importtime`, return a result record, or None if -X importtime is not
+    supported. The package yatg imports yatg.yatg on first use, so
+    yatg.yatg is imported explicitly. """
+    if sys.version_info < (3, 7):
+        return None
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', 'import yatg.yatg'],
+            stderr=subprocess.STDOUT,
+            cwd=package_dir).decode('utf-8')
+        # Lines of the package and the module are both top level, format of
+        # each line is:
+        # import time: self [us] | cumulative | imported package
+        seconds = 0.0
+        for line in output.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() in ('yatg', 'yatg.yatg'):
+                seconds += int(fields[1]) / 1e6
+        if best is None or seconds < best:
+            best = seconds
+    return {
+        'workload': 'startup',
+        'params': {},
+        'input': None,
+        'style': None,
+        'stage': 'import',
+        'seconds': best,
+        'cells': 0,
+    }
+
+
+def bench_daemon(repeat, sizes=(20, 2000), seed=0):
+    """ Time conversion of csv tables of each number of rows in sizes by cold
+    command line runs, and by --client runs against a daemon started by
+    --serve, with and without --width1-chars emoji. Return list of result
+    records. """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-c', 'import yatg; yatg.run_main()']
+    tmp_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(tmp_dir, 'yatg.sock')
+    server = subprocess.Popen(command + ['--serve', socket_path],
+                              cwd=package_dir,
+                              stderr=subprocess.PIPE)
+    records = []
+    try:
+        server.stderr.readline()  # wait until it is serving
+        for rows in sizes:
+            csv_content, _ = gen_workload(rows, 5, 0.0, 'emoji', 8, seed)
+            input_path = os.path.join(tmp_dir, 'input.csv')
+            with open(input_path, 'wb') as f:
+                f.write(csv_content.encode('utf-8'))
+            for width1_chars in ([], ['--width1-chars', 'emoji']):
+                options = ['-i', input_path] + width1_chars
+                for mode, args in (('cli', command + options),
+                                   ('client', command +
+                                    ['--client', socket_path] + options)):
+                    seconds, _ = time_call(
+                        lambda: subprocess.check_output(
+                            args, cwd=package_dir, stderr=subprocess.STDOUT),
+                        repeat)
+                    records.append({
+                        'workload': 'daemon',
+                        'params': {'rows': rows, 'cols': 5,
+                                   'width1_chars': bool(width1_chars)},
+                        'input': 'csv',
+                        'style': 'orgmode',
+                        'stage': mode,
+                        'seconds': seconds,
+                        'cells': rows * 5,
+                    })
+    finally:
+        server.terminate()
+        server.wait()
+        server.stderr.close()
+        shutil.rmtree(tmp_dir)
+    return records
+
+
+def bench_jobs(repeat, workers=(1, 2, 4), tables=16, seed=0):
+    """ Time html_2_ascii_table of tables html tables in one input, rendered
+    in current process and in a pool of each number of workers in workers.
+    Return list of result records, number of CPUs is in params of each. """
+    html_parts = []
+    for i in range(tables):
+        _, html_content = gen_workload(500, 10, 0.1, 'cjk', 8, seed + i)
+        html_parts.append(html_content)
+    html_content = u''.join(html_parts)
+    try:
+        cpus = os.cpu_count()
+    except AttributeError:  # Python 2
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    records = []
+    for num in workers:
+        seconds, _ = time_call(
+            lambda: yatg.html_2_ascii_table(html_content, workers=num),
+            repeat, setup=yatg.WIDTH_CACHE.clear)
+        records.append({
+            'workload': 'jobs',
+            'params': {'tables': tables, 'rows': 500, 'cols': 10,
+                       'cpus': cpus},
+            'input': 'html',
+            'style': 'orgmode',
+            'stage': 'workers={0}'.format(num),
+            'seconds': seconds,
+            'cells': tables * 500 * 10,
+        })
+    return records
+
+
+def run(workloads=None, repeat=3, seed=0, styles=None, scale=1.0,
+        startup=True, daemon=False, jobs=False):
+    """ Run benchmark, return a dict which can be dumped as JSON.
+
+    Arguments:
+      workloads: Names of workloads in WORKLOADS to run, run all if None.
+      repeat: Each stage is run repeat times, the best time is reported.
+      seed: Seed of random for generating workloads.
+      styles: Output styles to benchmark, all styles if None.
+      scale: Number of rows of each workload is multiplied by scale.
+      startup: Benchmark `import yatg.yatg` or not.
+      daemon: Benchmark --client runs against cold command line runs or not.
+      jobs: Benchmark html tables rendered in a pool of workers or not.
+    """
+    results = []
+    if startup:
+        record = bench_startup(repeat)
+        if record is not None:
+            results.append(record)
+    if daemon:
+        results.extend(bench_daemon(repeat, seed=seed))
+    if jobs:
+        results.extend(bench_jobs(repeat, seed=seed))
+    for name, params in WORKLOADS:
+        if workloads and name not in workloads:
+            continue
+        params = dict(params, rows=max(2, int(params['rows'] * scale)))
+        results.extend(bench_workload(name, params, repeat, seed, styles))
+    return {
+        'yatg_version': yatg.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark yatg with synthetic tables, output JSON.")
+    parser.add_argument('-w', '--workload', action='append',
+                        choices=[name for name, _ in WORKLOADS],
+                        help="workload to run, can be given multiple times. "
+                        "All workloads are run by default.")
+    parser.add_argument('-s', '--style', action='append',
+                        choices=list(yatg.RENDERERS),
+                        help="output style to benchmark, can be given "
+                        "multiple times. All styles are run by default.")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="run each stage REPEAT times and report the "
+                        "best time, default is 3.")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiply number of rows of each workload by "
+                        "SCALE, default is 1.0.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of random for generating workloads.")
+    parser.add_argument('--no-startup', action='store_true',
+                        help="do not benchmark `import yatg`.")
+    parser.add_argument('--daemon', action='store_true',
+                        help="benchmark --client runs against a daemon "
+                        "started by --serve, compared to cold runs.")
+    parser.add_argument('--jobs', action='store_true',
+                        help="benchmark html tables rendered in a pool of 2 "
+                        "and 4 workers, compared to current process.")
+    parser.add_argument('-o', '--output-file',
+                        help="write JSON to OUTPUT_FILE instead of stdout.")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        sys.stderr.write("--repeat is not valid, it must be positive.\n")
+        sys.exit(1)
+    result = run(args.workload, args.repeat, args.seed, args.style,
+                 args.scale, not args.no_startup, args.daemon, args.jobs)
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+""" Thin client of yatg daemon (see yatg --serve).
+
+It only imports socket, json and sys, so that starting it is much faster than
+importing yatg.yatg. Options other than --client, -i/--input-file and
+-o/--output-file are sent to the daemon, which parses them as yatg does.
+
+Example::
+
+  $ yatg --serve /tmp/yatg.sock &
+  $ yatg --client /tmp/yatg.sock -s mysql -i a.csv
+"""
+
+import json
+import socket
+import sys
+
+# Size of blocks sent to and read from the daemon
+BLOCK_SIZE = 64 * 1024
+
+# Options handled by the client, rather than the daemon
+CLIENT_OPTIONS = {'--client': 'client',
+                  '-i': 'input_file', '--input-file': 'input_file',
+                  '-o': 'output_file', '--output-file': 'output_file'}
+
+# Options with which the daemon does not read input
+NO_INPUT_OPTIONS = ('-h', '--help', '--version')
+
+
+def split_client_argv(argv):
+    """ Split command line arguments argv (without program name) into a dict of
+    client options and a list of arguments sent to the daemon. """
+    client_options = {}
+    daemon_argv = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--':
+            daemon_argv.append(arg)
+            daemon_argv.extend(args)
+            break
+        if arg.startswith('--') and '=' in arg:  # e.g. --input-file=a.csv
+            name, value = arg.split('=', 1)
+        elif arg[:2] in ('-i', '-o') and len(arg) > 2:  # e.g. -ia.csv
+            name, value = arg[:2], arg[2:]
+        else:
+            name, value = arg, None
+        if name not in CLIENT_OPTIONS:
+            daemon_argv.append(arg)
+            continue
+        if value is None:
+            value = next(args, None)
+            if value is None:
+                raise ValueError("option {0} requires an argument".format(name))
+        key = CLIENT_OPTIONS[name]
+        if key in client_options:
+            raise ValueError("option {0} is given more than once, multiple "
+                             "input files are not supported by --client"
+                             .format(name))
+        client_options[key] = value
+    return client_options, daemon_argv
+
+
+def send_request(socket_path, daemon_argv, infile, open_output, stderr):
+    """ Send infile (binary stream) with daemon_argv to the daemon serving on
+    unix socket socket_path. No input is sent if infile is None. open_output
+    is called to get the binary stream which the table is written to, only
+    after the daemon replies that the conversion succeeded, so that a failed
+    conversion does not leave an empty or truncated output file behind.
+    Return exit code of the conversion. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error as e:
+            stderr.write("Error: cannot connect to daemon on {0}: {1}\n".format(
+                socket_path, e))
+            return 1
+        header = {'argv': daemon_argv}
+        sock.sendall(json.dumps(header).encode('utf-8') + b'\n')
+        while infile is not None:
+            block = infile.read(BLOCK_SIZE)
+            if not block:
+                break
+            sock.sendall(block)
+        sock.shutdown(socket.SHUT_WR)
+        rfile = sock.makefile('rb')
+        response = json.loads(rfile.readline().decode('utf-8'))
+        stderr.write(response['stderr'])
+        if response['exit_code'] == 0:
+            outfile = open_output()
+            while True:
+                block = rfile.read(BLOCK_SIZE)
+                if not block:
+                    break
+                outfile.write(block)
+        rfile.close()
+    finally:
+        sock.close()
+    return response['exit_code']
+
+
+def main(argv, stdin=None, stdout=None, stderr=None):
+    """ Entry of yatg --client, argv is same as sys.argv. stdin and stdout are
+    binary streams, default to those of sys. Return exit code. """
+    stdin = stdin or getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = stdout or getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = stderr or sys.stderr
+    try:
+        client_options, daemon_argv = split_client_argv(argv[1:])
+    except ValueError as e:
+        stderr.write("Error: {0}\n".format(e))
+        return 2
+    input_file = client_options.get('input_file')
+    output_file = client_options.get('output_file')
+    infile = None
+    outfiles = []
+
+    def open_output():
+        if output_file is None:
+            return stdout
+        outfiles.append(open(output_file, 'wb'))
+        return outfiles[0]
+
+    try:
+        if input_file is not None:
+            infile = open(input_file, 'rb')
+        elif not any(arg in NO_INPUT_OPTIONS for arg in daemon_argv):
+            stderr.write("Info: read data from stdin, press Ctrl-D (i.e. EOF) "
+                         "when finished\n")
+            infile = stdin
+        return send_request(client_options['client'], daemon_argv, infile,
+                            open_output, stderr)
+    except (IOError, OSError) as e:
+        stderr.write("Error: {0}\n".format(e))
+        return 1
+    finally:
+        if infile not in (None, stdin):
+            infile.close()
+        for outfile in outfiles:
+            outfile.close()
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
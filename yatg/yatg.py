@@ -8,77 +8,234 @@ __version__ = '0.11.5'
 __source__ = 'https://github.com/10gic/yatg'
 __license__ = 'AGPLv3+'
 
-__all__ = ['html_2_ascii_table', 'csv_2_ascii_table', 'FORCE_WIDTH1_CHARS']
-
+__all__ = [
+    'html_2_ascii_table', 'csv_2_ascii_table', 'iter_html_ascii_tables',
+    'iter_csv_ascii_table', 'render_to', 'FORCE_WIDTH1_CHARS', 'WIDTH_CACHE',
+    'WidthCache', 'ConversionStats', 'TableRenderer', 'register_renderer',
+    'unregister_renderer', 'RENDERERS'
+]
+
+import array
+import io
+import os
+import re
 import sys
+import errno
+import itertools
+import threading
+import time
 import unicodedata
-import logging
-import csv
+from collections import OrderedDict
 
-try:
-    from html.parser import HTMLParser  # Python 3
-except ImportError:
-    from HTMLParser import HTMLParser  # Python 2
+# Optional packages (emoji, blessed) are imported on first use, they are slow
+# to import and only needed by option --width1-chars emoji or --align-in-tty
+_OPTIONAL_MODULES = {}
 
-try:
-    import emoji
-    EMOJI_AVAILABLE = True
-except ImportError:
-    EMOJI_AVAILABLE = False
 
-try:
-    import blessed
-    BLESSED_AVAILABLE = True
-except ImportError:
-    BLESSED_AVAILABLE = False
-
-logger = logging.getLogger('app')
-logging.basicConfig(
-    format=
-    "[%(filename)s:%(lineno)-3s:%(funcName)20s %(levelname)s] %(message)s",
-    level=logging.INFO)
-
-# Maximum number of rows that supported, you can enlarge it for big table
-MAX_TABLE_ROWS = 500
-# Maximum number of columns that supported, you can enlarge it for big table
-MAX_TABLE_COLS = 100
+def import_optional(name):
+    """ Import optional package name on first call, return the module, or
+    None if it's not installed. """
+    if name not in _OPTIONAL_MODULES:
+        try:
+            _OPTIONAL_MODULES[name] = __import__(name)
+        except ImportError:
+            _OPTIONAL_MODULES[name] = None
+    return _OPTIONAL_MODULES[name]
+
+
+class LazyLogger(object):
+    """ Logger which imports logging on first use. Logging is not configured
+    here, application which embeds yatg configures it. If logging has never
+    been imported, it's not configured and debug records would be dropped, so
+    debug() returns immediately without importing it. """
+
+    def __init__(self, name):
+        self.name = name
+
+    def debug(self, *args, **kwargs):
+        if 'logging' in sys.modules:
+            self._logger().debug(*args, **kwargs)
+
+    def _logger(self):
+        import logging
+        return logging.getLogger(self.name)
+
+    def __getattr__(self, attr):
+        return getattr(self._logger(), attr)
+
+
+logger = LazyLogger('app')
 
 FORCE_WIDTH1_CHARS = []
 
+# State of the conversion which is running in current thread:
+#   stats: its ConversionStats, it's set by _iter_profiled while each line is
+#          generated, so that counters of concurrent conversions are not
+#          mixed, and nothing is counted without stats
+#   width1_chars: its chars forced to be width 1, it's set by
+#                 _iter_with_width1_chars, FORCE_WIDTH1_CHARS is used if None
+class _ActiveConversion(threading.local):
+    stats = None
+    width1_chars = None
+
+
+_ACTIVE_CONVERSION = _ActiveConversion()
+# Number of profiled conversions in process, width() looks up stats of
+# _ACTIVE_CONVERSION only if it's not 0
+_PROFILED_CONVERSIONS = [0]
+_PROFILED_CONVERSIONS_LOCK = threading.Lock()
+
+
+class TermWidthSession(object):
+    """ Measure width of strings rendered in terminal. The terminal is opened
+    once and shared by all measurements of the session. """
+
+    def __init__(self):
+        self.term = import_optional('blessed').Terminal()
+
+    def measure(self, strings):
+        """ Return a dict which maps each string in strings to its width
+        rendered in terminal, width is -1 if not in a tty.
+
+        Duplicated strings are measured once. Width of ASCII string is its
+        length, only strings contain non-ASCII chars are sent to terminal. They
+        are measured in one batch, with a single cursor position round trip
+        for each string.
+        NOTE: If width of string is large that term.width, you would get a
+        truncate length, and the char(s) in term may not be clear!!! FIXME
+        """
+        result = {}
+        pending = []
+        for s in strings:
+            s = to_unicode(s)
+            if s in result:
+                continue
+            if is_ascii(s):
+                result[s] = len(s)
+            else:
+                result[s] = -1
+                pending.append(s)
+        term = self.term
+        if not pending or not term.is_a_tty:
+            return result
+        logger.debug("current term width = %d, measure %d strings",
+                     term.width, len(pending))
+
+        stats = _ACTIVE_CONVERSION.stats
+        if stats is not None:
+            stats.term_measures += len(pending)
+        with term.cbreak(), term.location(y=term.height - 1, x=0):
+            _, y0 = term.get_location(timeout=5.0)  # store first position
+            assert y0 != -1, "get_location return -1,-1, may be you not in a tty"
+            for s in pending:
+                term.stream.write(s)  # put char(s) to term
+                _, y1 = term.get_location(timeout=5.0)  # store second position
+                assert y1 != -1, \
+                    "get_location return -1,-1, may be you not in a tty"
+                horizontal_distance = y1 - y0  # determine distance
+                # clear char(s) in term, cursor is back to first position
+                term.stream.write('\b \b' * horizontal_distance)
+                result[s] = horizontal_distance
+            term.stream.flush()
+        return result
+
+
+_TERM_WIDTH_SESSION = []  # shared TermWidthSession, created on first use
+
+
+def measure_term_widths(strings):
+    """ Measure width of strings rendered in terminal in one batch, return a
+    dict which maps each string to its width. """
+    if not _TERM_WIDTH_SESSION:
+        _TERM_WIDTH_SESSION.append(TermWidthSession())
+    return _TERM_WIDTH_SESSION[0].measure(strings)
+
+
+def measure_cells_in_term(strings, align_in_tty):
+    """ Measure strings in terminal in one batch if align_in_tty and package
+    blessed is available, return a dict which maps each string to its width.
+    Return None otherwise, then width() of each string is used. """
+    if align_in_tty and import_optional('blessed') is not None:
+        return measure_term_widths(strings)
+    return None
+
 
 def width_from_term(s):
-    """ Get width of s render in terminal, return -1 if not in a tty.
-    NOTE: If width of s is large that term.width, you would get a truncate
-    length, and the char(s) in term may not be clear!!! FIXME
-    """
-    term = blessed.Terminal()
-    if not term.is_a_tty:
-        return -1
-    logger.debug("current term width = %d", str(term.width))
-
-    with term.cbreak(), term.location(y=term.height - 1, x=0):
-        _, y0 = term.get_location(timeout=5.0)  # store first position
-        assert y0 != -1, "get_location return -1,-1, may be you not in a tty"
-        sys.stdout.write(s)  # put char(s) to term
-        _, y1 = term.get_location(timeout=5.0)  # store second position
-        assert y0 != -1, "get_location return -1,-1, may be you not in a tty"
-        horizontal_distance = y1 - y0  # determine distance
-        sys.stdout.write(
-            '\b \b' * horizontal_distance)  # clear char(s) in term
-        return horizontal_distance
-
-
-def wide_chars(s):
-    """ Return the number of wide chars in string s. WIDE(W) and FULLWIDTH(F) is
-    considered as wide chars. AMBIGUOUS(A), for example “”‘’, is not wide."""
-    if 'emoji' in FORCE_WIDTH1_CHARS and EMOJI_AVAILABLE:
-        # consider emoji as width 1 if it in FORCE_WIDTH1_CHARS
-        return sum(x not in emoji.UNICODE_EMOJI and \
-                   (unicodedata.east_asian_width(x) == 'W' or \
-                    unicodedata.east_asian_width(x) == 'F') for x in s)
-    return sum(
-        unicodedata.east_asian_width(x) == 'W'
-        or unicodedata.east_asian_width(x) == 'F' for x in s)
+    """ Get width of s render in terminal, return -1 if not in a tty. """
+    s = to_unicode(s)
+    return measure_term_widths([s])[s]
+
+
+if sys.version_info[0] < 3:  # python 2
+    _unichr = unichr
+else:
+    _unichr = chr
+
+if hasattr(str, 'isascii'):  # python 3.7+
+
+    def is_ascii(s):
+        """ Return true if all chars in unicode string s are ASCII """
+        return s.isascii()
+else:
+    _NON_ASCII_RE = re.compile(u'[^\x00-\x7f]')
+
+    def is_ascii(s):
+        """ Return true if all chars in unicode string s are ASCII """
+        return _NON_ASCII_RE.search(s) is None
+
+# Width of each code point, stored in blocks of 256 code points. A block is
+# computed from unicodedata when a char in it is met first time. WIDE(W) and
+# FULLWIDTH(F) chars are width 2, AMBIGUOUS(A), for example “”‘’, is not wide.
+# Combining marks (Mn, Me) are width 0, as they are drawn over previous char.
+_CHAR_WIDTH_BLOCKS = {}
+
+
+def _build_char_width_block(block):
+    table = bytearray(256)
+    for offset in range(256):
+        try:
+            ch = _unichr((block << 8) + offset)
+        except ValueError:  # narrow build of python 2
+            table[offset] = 1
+            continue
+        if unicodedata.east_asian_width(ch) in ('W', 'F'):
+            table[offset] = 2
+        elif unicodedata.category(ch) in ('Mn', 'Me'):
+            table[offset] = 0
+        else:
+            table[offset] = 1
+    _CHAR_WIDTH_BLOCKS[block] = table
+    return table
+
+
+def char_width(ch):
+    """ Return the width of char ch """
+    code = ord(ch)
+    if code < 0x80:
+        return 1
+    table = _CHAR_WIDTH_BLOCKS.get(code >> 8)
+    if table is None:
+        table = _build_char_width_block(code >> 8)
+    return table[code & 0xFF]
+
+
+def str_width(s):
+    """ Return the width of unicode string s, width of ASCII string is its
+    length. """
+    if is_ascii(s):
+        return len(s)
+    blocks = _CHAR_WIDTH_BLOCKS
+    result = 0
+    for ch in s:
+        code = ord(ch)
+        if code < 0x80:
+            result += 1
+            continue
+        table = blocks.get(code >> 8)
+        if table is None:
+            table = _build_char_width_block(code >> 8)
+        result += table[code & 0xFF]
+    return result
 
 
 def to_unicode(s):
@@ -89,166 +246,383 @@ def to_unicode(s):
     return s
 
 
-def width(s, align_in_tty):
-    """ Return the width of string s."""
-    s = to_unicode(s)
-    if align_in_tty and BLESSED_AVAILABLE:
-        return width_from_term(s)
-    return len(s) + wide_chars(s)
+class WidthCache(object):
+    """ A bounded cache of string width, the least recently used entry is
+    evicted when it is full. Numbers of hits and misses are counted, see
+    cache_info(). It's shared by conversions running in threads, e.g. by the
+    daemon, so it's updated under a lock. """
 
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Return cached value of key, return None if key is not cached """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value  # move key to the most recently used end
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)  # evict least recently used
+
+    def clear(self):
+        """ Remove all cached entries and reset hits and misses """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'currsize': len(self._data)
+        }
+
+
+# Width cache shared by all conversions in current process. Set its maxsize to
+# 0 to disable it, or call WIDTH_CACHE.clear() to drop cached widths.
+WIDTH_CACHE = WidthCache()
+
+
+def get_width1_chars():
+    """ Return chars forced to be width 1 in the conversion running in current
+    thread, it's FORCE_WIDTH1_CHARS unless the conversion has its own. """
+    width1_chars = _ACTIVE_CONVERSION.width1_chars
+    return FORCE_WIDTH1_CHARS if width1_chars is None else width1_chars
+
+
+def _iter_with_width1_chars(lines, width1_chars):
+    """ Generate lines, width1_chars are forced to be width 1 while each line
+    is generated, rather than FORCE_WIDTH1_CHARS shared by all conversions. """
+    lines = iter(lines)
+    while True:
+        previous = _ACTIVE_CONVERSION.width1_chars
+        _ACTIVE_CONVERSION.width1_chars = width1_chars
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        finally:
+            _ACTIVE_CONVERSION.width1_chars = previous
+        yield line
 
-class MyTableCell:
-    """ Represent cell in table """
 
-    def __init__(self, data='', cell_type='th', attrs=None):
+def width(s, align_in_tty):
+    """ Return the width of string s. Width of ASCII string is its length,
+    unless it's measured in terminal, widths of other strings are cached in
+    WIDTH_CACHE."""
+    s = to_unicode(s)
+    stats = _ACTIVE_CONVERSION.stats if _PROFILED_CONVERSIONS[0] else None
+    if stats is not None:
+        stats.width_calls += 1
+    if not align_in_tty and is_ascii(s):
+        return len(s)
+    key = (s, align_in_tty, 'emoji' in get_width1_chars())
+    result = WIDTH_CACHE.get(key)
+    if result is None:
+        if stats is not None:
+            stats.width_computed += 1
+        result = compute_width(s, align_in_tty)
+        WIDTH_CACHE.put(key, result)
+    return result
+
+
+def compute_width(s, align_in_tty):
+    """ Return the width of string s, without cache."""
+    s = to_unicode(s)
+    if align_in_tty and import_optional('blessed') is not None:
+        return width_from_term(s)
+    if 'emoji' in get_width1_chars():
+        emoji_matcher = get_emoji_matcher()
+        if emoji_matcher is not None:
+            # consider emoji as width 1 if it's forced to be width 1
+            return emoji_matcher.str_width(s)
+    return str_width(s)
+
+
+def _emoji_sequences(emoji):
+    """ Return all emoji (single char or sequence of chars) known by package
+    emoji, its API differs between versions. """
+    data = getattr(emoji, 'EMOJI_DATA', None)  # emoji >= 2.0
+    if data is None:
+        data = emoji.UNICODE_EMOJI
+        if 'en' in data:  # emoji 1.x, keyed by language
+            data = data['en']
+    return data
+
+
+class EmojiMatcher(object):
+    """ Measure width of string in which each emoji is width 1. Emoji (single
+    char or sequence of chars, such as ZWJ sequence, emoji with skin tone
+    modifier, and flag) are compiled once into a trie, and a regex of chars
+    which can start an emoji. The regex finds runs of candidate chars, then
+    the trie consumes the longest emoji sequence at each position in one
+    step. """
+
+    def __init__(self, sequences):
+        self.trie = {}
+        for sequence in sequences:
+            node = self.trie
+            for ch in sequence:
+                node = node.setdefault(ch, {})
+            node[''] = True  # end of an emoji sequence
+        # Regex of a char set is fast only if all chars in it are in BMP, so
+        # any char out of BMP is a candidate, trie tells whether it's emoji
+        first_chars = ''.join(
+            re.escape(ch) for ch in sorted(self.trie) if ord(ch) <= 0xFFFF)
+        if sys.maxunicode > 0xFFFF:
+            first_chars += u'\U00010000-\U0010FFFF'
+        self.first_char_re = re.compile(u'[' + first_chars + u']+')
+
+    def str_width(self, s):
+        """ Return width of string s, each emoji or emoji sequence is width 1,
+        width of other chars is computed by str_width. """
+        total = 0
+        pos = 0  # start of chars not measured yet
+        trie = self.trie
+        length = len(s)
+        # Each run of candidate chars is scanned by trie, an emoji sequence
+        # may go beyond the run, e.g. its ZWJ or variation selector
+        for run in self.first_char_re.finditer(s):
+            index, run_end = run.span()
+            if index < pos:
+                index = pos
+            while index < run_end:
+                # find end of the longest emoji sequence starts at index
+                node = trie
+                end = -1
+                cursor = index
+                while cursor < length:
+                    node = node.get(s[cursor])
+                    if node is None:
+                        break
+                    cursor += 1
+                    if '' in node:
+                        end = cursor
+                if end < 0:
+                    index += 1
+                    continue
+                if index > pos:
+                    total += str_width(s[pos:index])
+                total += 1
+                pos = index = end
+        if pos < length:
+            total += str_width(s[pos:])
+        return total
+
+
+_EMOJI_MATCHER = []  # shared EmojiMatcher, created on first use
+
+
+def get_emoji_matcher():
+    """ Return the shared EmojiMatcher of all emoji known by package emoji,
+    or None if package emoji is not installed. """
+    if not _EMOJI_MATCHER:
+        emoji = import_optional('emoji')
+        if emoji is None:
+            return None
+        _EMOJI_MATCHER.append(EmojiMatcher(_emoji_sequences(emoji)))
+    return _EMOJI_MATCHER[0]
+
+
+class MyTableCell(object):
+    """ Represent cell in table. colspan and rowspan are parsed from html
+    attrs once when cell is created. Cells in same span share same non-zero
+    span_id, span_id of cell not in any span is 0. """
+    __slots__ = ('data', 'cell_type', 'colspan', 'rowspan', 'span_id')
+
+    def __init__(self,
+                 data='',
+                 cell_type='th',
+                 attrs=None,
+                 colspan=1,
+                 rowspan=1,
+                 span_id=0):
         self.data = data
         self.cell_type = cell_type
-        self.attrs = attrs
-
-    def get_colspan(self):
-        if self.attrs is None:
-            return 1
-        for attr in self.attrs:
-            if attr[0] == 'colspan':
-                return int(attr[1])
-        return 1  # default
+        self.colspan = colspan
+        self.rowspan = rowspan
+        self.span_id = span_id
+        if attrs:
+            # In reverse order, so the first one wins if attr is duplicated
+            for attr in reversed(attrs):
+                if attr[0] == 'colspan':
+                    self.colspan = int(attr[1])
+                elif attr[0] == 'rowspan':
+                    self.rowspan = int(attr[1])
+
+    def __reduce__(self):
+        # Pickle cell as constructor arguments, it's much more compact and
+        # faster than the default pickling of __slots__ state
+        return (MyTableCell, (self.data, self.cell_type, None, self.colspan,
+                              self.rowspan, self.span_id))
+
+
+# MyHTMLParser class, it's defined on first html conversion, as html.parser
+# is only needed for html input
+_HTML_PARSER_CLASS = []
+
+
+def get_html_parser_class():
+    """ Return MyHTMLParser class, html.parser is imported on first call """
+    if _HTML_PARSER_CLASS:
+        return _HTML_PARSER_CLASS[0]
+    try:
+        from html.parser import HTMLParser  # Python 3
+    except ImportError:
+        from HTMLParser import HTMLParser  # Python 2
 
-    def get_rowspan(self):
-        if self.attrs is None:
-            return 1
-        for attr in self.attrs:
-            if attr[0] == 'rowspan':
-                return int(attr[1])
-        return 1  # default
+    class MyHTMLParser(HTMLParser):
+        """ This class serves as a html table parser. It is able to parse
+        multiple tables which you feed in. You can access the result per
+        .tables field. Modified from
+        https://github.com/schmijos/html-table-parser-python3
+        """
 
+        def __init__(
+                self,
+                data_separator='',
+        ):
+            HTMLParser.__init__(self)
 
-class MyHTMLParser(HTMLParser):
-    """ This class serves as a html table parser. It is able to parse multiple
-    tables which you feed in. You can access the result per .tables field.
-    Modified from https://github.com/schmijos/html-table-parser-python3
-    """
+            self._data_separator = data_separator
 
-    def __init__(
-            self,
-            data_separator='',
-    ):
-        HTMLParser.__init__(self)
-
-        self._data_separator = data_separator
-
-        self._in_td = False
-        self._in_th = False
-        self._in_tr = False
-        self._attrs = []
-        self._current_table = []
-        self._current_row = []
-        self._current_cell = []
-        self.tables = []
-
-    def handle_starttag(self, tag, attrs):
-        """ We need to remember the opening point for the content of interest.
-        The other tags (<table>, <tr>) are only handled at the closing point.
-        """
-        # logger.debug("handle_starttag tag=[%s], attrs=%s", tag, attrs)
-        if tag in ['td', 'th', 'tr']:
-            # Handle the case of ignoring closing tag tr/th/td, for example:
-            # <table border=1>
-            #  <tr><th>row1,col1<th>row1,col2
-            #  <tr><td>row2,col1<td>row2,col2
-            # </table>
-            if self._in_th:
-                self.handle_endtag('th')
-            elif self._in_td:
-                self.handle_endtag('td')
-            if tag == 'tr' and self._in_tr:
-                self.handle_endtag('tr')
-        if tag == 'td':
-            self._in_td = True
-        if tag == 'th':
-            self._in_th = True
-        if tag == 'tr':
-            self._in_tr = True
-        if tag in ['td', 'th']:
-            self._attrs = attrs
-        # Just convert <br> to one space
-        if tag == 'br' and (self._in_td or self._in_th):
-            self._current_cell.append(' ')
-
-    def handle_data(self, data):
-        """ This is where we save content to a cell """
-        if self._in_td or self._in_th:
-            # logger.debug("handle_data data=[%s]", data)
-            data = to_unicode(data)
-            self._current_cell.append(data)
-
-    def handle_entityref(self, name):
-        """ Handle HTML encoded characters &NAME, for example &gt;, &nbsp;
-        Note: this function only called when python version < 3.5,
-        In python 3.5+, HTMLParser(*, convert_charrefs=True), the default
-        of convert_charrefs is True, handle_entityref is not called."""
-        if name == 'nbsp':
-            # self.unescape('&nbsp;') produce NO-BREAK SPACE(0xA0)
-            # but, we need SPACE(0x20).
-            unescaped = " "
-        else:
-            unescaped = self.unescape('&{0};'.format(name))
-        self.handle_data(unescaped)
-
-    def handle_charref(self, name):
-        """ Handle HTML encoded characters &#NNN, for example &#62;
-        Note: this function only called when python version < 3.5,
-        In python 3.5+, HTMLParser(*, convert_charrefs=True), the default
-        of convert_charrefs is True, handle_charref is not called."""
-        if name == '160':
-            # self.unescape('&#160;') produce NO-BREAK SPACE(0xA0)
-            # but, we need SPACE(0x20).
-            unescaped = " "
-        else:
-            unescaped = self.unescape('&#{0};'.format(name))
-        self.handle_data(unescaped)
-
-    def handle_endtag(self, tag):
-        """ Here we exit the tags. If the closing tag is </tr>, we know that we
-        can save our currently parsed cells to the current table as a row and
-        prepare for a new row. If the closing tag is </table>, we save the
-        current table and prepare for a new one.
-        """
-        # logger.debug("handle_endtag tag=[%s]", tag)
-        if tag == 'table':
-            # Handle the case of ignoring closing tag tr/th/td, for example:
-            # <table border=1>
-            #  <tr><th>row1,col1<th>row1,col2
-            #  <tr><td>row2,col1<td>row2,col2
-            # </table>
-            if self._in_th:
-                self.handle_endtag('th')
-            elif self._in_td:
-                self.handle_endtag('td')
-            if self._in_tr:
-                self.handle_endtag('tr')
-        if tag == 'td':
             self._in_td = False
-        elif tag == 'th':
             self._in_th = False
-        elif tag == 'tr':
             self._in_tr = False
-
-        if tag in ['td', 'th']:
-            final_cell = self._data_separator.join(self._current_cell).strip()
-            final_cell = final_cell.replace('\r\n', \
-                                    ' ').replace('\r', ' ').replace('\n', ' ')
-            # Remove leading and tailing tab, replace tab in mid to one space
-            final_cell = final_cell.strip('\t')
-            final_cell = final_cell.replace('\t', ' ')
-            self._current_row.append(MyTableCell(final_cell, tag, self._attrs))
-            self._current_cell = []
             self._attrs = []
-        elif tag == 'tr':
-            self._current_table.append(self._current_row)
-            self._current_row = []
-        elif tag == 'table':
-            self.tables.append(self._current_table)
             self._current_table = []
+            self._current_row = []
+            self._current_cell = []
+            self.tables = []
+
+        def handle_starttag(self, tag, attrs):
+            """ We need to remember the opening point for the content of
+            interest. The other tags (<table>, <tr>) are only handled at the
+            closing point.
+            """
+            # logger.debug("handle_starttag tag=[%s], attrs=%s", tag, attrs)
+            if tag in ['td', 'th', 'tr']:
+                # Handle the case of ignoring closing tag tr/th/td, e.g.:
+                # <table border=1>
+                #  <tr><th>row1,col1<th>row1,col2
+                #  <tr><td>row2,col1<td>row2,col2
+                # </table>
+                if self._in_th:
+                    self.handle_endtag('th')
+                elif self._in_td:
+                    self.handle_endtag('td')
+                if tag == 'tr' and self._in_tr:
+                    self.handle_endtag('tr')
+            if tag == 'td':
+                self._in_td = True
+            if tag == 'th':
+                self._in_th = True
+            if tag == 'tr':
+                self._in_tr = True
+            if tag in ['td', 'th']:
+                self._attrs = attrs
+            # Just convert <br> to one space
+            if tag == 'br' and (self._in_td or self._in_th):
+                self._current_cell.append(' ')
+
+        def handle_data(self, data):
+            """ This is where we save content to a cell """
+            if self._in_td or self._in_th:
+                # logger.debug("handle_data data=[%s]", data)
+                data = to_unicode(data)
+                self._current_cell.append(data)
+
+        def handle_entityref(self, name):
+            """ Handle HTML encoded characters &NAME, for example &gt;, &nbsp;
+            Note: this function only called when python version < 3.5,
+            In python 3.5+, HTMLParser(*, convert_charrefs=True), the default
+            of convert_charrefs is True, handle_entityref is not called."""
+            if name == 'nbsp':
+                # self.unescape('&nbsp;') produce NO-BREAK SPACE(0xA0)
+                # but, we need SPACE(0x20).
+                unescaped = " "
+            else:
+                unescaped = self.unescape('&{0};'.format(name))
+            self.handle_data(unescaped)
+
+        def handle_charref(self, name):
+            """ Handle HTML encoded characters &#NNN, for example &#62;
+            Note: this function only called when python version < 3.5,
+            In python 3.5+, HTMLParser(*, convert_charrefs=True), the default
+            of convert_charrefs is True, handle_charref is not called."""
+            if name == '160':
+                # self.unescape('&#160;') produce NO-BREAK SPACE(0xA0)
+                # but, we need SPACE(0x20).
+                unescaped = " "
+            else:
+                unescaped = self.unescape('&#{0};'.format(name))
+            self.handle_data(unescaped)
+
+        def handle_endtag(self, tag):
+            """ Here we exit the tags. If the closing tag is </tr>, we know
+            that we can save our currently parsed cells to the current table
+            as a row and prepare for a new row. If the closing tag is
+            </table>, we save the current table and prepare for a new one.
+            """
+            # logger.debug("handle_endtag tag=[%s]", tag)
+            if tag == 'table':
+                # Handle the case of ignoring closing tag tr/th/td, e.g.:
+                # <table border=1>
+                #  <tr><th>row1,col1<th>row1,col2
+                #  <tr><td>row2,col1<td>row2,col2
+                # </table>
+                if self._in_th:
+                    self.handle_endtag('th')
+                elif self._in_td:
+                    self.handle_endtag('td')
+                if self._in_tr:
+                    self.handle_endtag('tr')
+            if tag == 'td':
+                self._in_td = False
+            elif tag == 'th':
+                self._in_th = False
+            elif tag == 'tr':
+                self._in_tr = False
+
+            if tag in ['td', 'th']:
+                final_cell = self._data_separator.join(
+                    self._current_cell).strip()
+                final_cell = final_cell.replace('\r\n', ' ').replace(
+                    '\r', ' ').replace('\n', ' ')
+                # Remove leading and tailing tab, replace tab in mid to one
+                # space
+                final_cell = final_cell.strip('\t')
+                final_cell = final_cell.replace('\t', ' ')
+                self._current_row.append(
+                    MyTableCell(final_cell, tag, self._attrs))
+                self._current_cell = []
+                self._attrs = []
+            elif tag == 'tr':
+                self._current_table.append(self._current_row)
+                self._current_row = []
+            elif tag == 'table':
+                self.tables.append(self._current_table)
+                self._current_table = []
+
+    _HTML_PARSER_CLASS.append(MyHTMLParser)
+    return MyHTMLParser
 
 
 def dump_cell_types(table):
@@ -257,11 +631,28 @@ def dump_cell_types(table):
     for i, _ in enumerate(table):
         current_row = ""
         for j, _ in enumerate(table[i]):
-            current_row += "None\t" if table[i][j] is None else table[i][j].cell_type + "\t"
+            cell = table[i][j]
+            if cell is None:
+                current_row += "None\t"
+            elif cell.span_id:
+                current_row += "span" + str(cell.span_id) + "\t"
+            else:
+                current_row += cell.cell_type + "\t"
         out_str += current_row + "\n"
     return out_str
 
 
+class CellTypesDump(object):
+    """ Argument of logger.debug, the table is dumped by dump_cell_types only
+    if the record is emitted. """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __str__(self):
+        return dump_cell_types(self.table)
+
+
 class IncreaseUp(object):
     """ For generating auto-increase span id """
 
@@ -297,95 +688,76 @@ def gen_expand_table(origtable):
     td	td	td	td
     td	td	td	td
     td	td	td	td
-    span0	span0	span0	td
-    span1	span1	td	td
-    span2	span2	span2	td
+    span1	span1	span1	td
+    span2	span2	td	td
+    span3	span3	span3	td
 
-    If the ID part in spanID is same, means it in same span cell.
+    Cells in same span cell have same span_id (the ID part in spanID).
     """
-    logger.debug("origtable is:\n" + dump_cell_types(origtable))
+    logger.debug("origtable is:\n%s", CellTypesDump(origtable))
+    # Rows and columns are allocated on demand, so the grid grows to exactly
+    # the size that table needs
     table_expand_spans = []
-    for i in range(MAX_TABLE_ROWS):
-        table_expand_spans.append([])
-        for _ in range(MAX_TABLE_COLS):
-            table_expand_spans[i].append(None)  # Initialize each cell to None
 
-    span_id = IncreaseUp(0)
+    span_id = IncreaseUp(1)
 
-    pending_no_leader_span_cells = []
-    for i in range(MAX_TABLE_ROWS):
-        colspan_passed = 0
+    # Non-leader cells of rowspan, keyed by the row index they belong to, each
+    # item is (column index, span id)
+    pending_no_leader_span_cells = {}
+    for i in range(len(origtable) + 1):
+        current_row = []
+        table_expand_spans.append(current_row)
 
         # Check pending no leader span cells
-        pending_span_cells_current_row = filter(lambda item: item[0] == i,
-                                                pending_no_leader_span_cells)
-        for item in pending_span_cells_current_row:
-            logger.debug("normal span cell index is: %d, %d", item[0], item[1])
-            colspan_passed += 1
-            table_expand_spans[i][item[1]] = MyTableCell(None, item[2])
+        for item in pending_no_leader_span_cells.pop(i, []):
+            logger.debug("normal span cell index is: %d, %d", i, item[0])
+            _set_cell(current_row, item[0],
+                      MyTableCell(None, "span", span_id=item[1]))
         if i > len(origtable) - 1:
             break
+        next_free = 0  # cursor of first free cell in current row
         for j, _ in enumerate(origtable[i]):
-            colspan = origtable[i][j].get_colspan()
+            colspan = origtable[i][j].colspan
             assert colspan > 0, "Find colspan <= 0"
-            rowspan = origtable[i][j].get_rowspan()
+            rowspan = origtable[i][j].rowspan
             assert rowspan > 0, "Find rowspan <= 0"
 
-            try:
-                # find index of first None cell, and insert data
-                item_index = table_expand_spans[i].index(None)
-                if colspan > 1 or rowspan > 1:
-                    current_span_id = "span" + str(span_id.next())
-                    table_expand_spans[i][item_index] = MyTableCell(
-                        origtable[i][j].data, current_span_id,
-                        origtable[i][j].attrs)
-                else:
-                    table_expand_spans[i][item_index] = origtable[i][j]
-            except ValueError:  # If None is not found in table_expand_spans
-                sys.stderr.write(
-                    "Warn: your table has too many columns, only output partial result.\n"
-                )
+            # find index of first free cell, and insert data
+            next_free = _next_free_index(current_row, next_free)
+            if colspan > 1 or rowspan > 1:
+                current_span_id = span_id.next()
+                current_row[next_free] = MyTableCell(
+                    origtable[i][j].data, "span", None, colspan, rowspan,
+                    current_span_id)
+            else:
+                current_row[next_free] = origtable[i][j]
+            span_indexes = [next_free]
             for _ in range(colspan - 1):
-                try:
-                    # find index of first None cell, and insert spanID
-                    item_index = table_expand_spans[i].index(None)
-                    table_expand_spans[i][item_index] = MyTableCell(
-                        None, current_span_id)
-                except ValueError:  # If None is not found in table_expand_spans
-                    sys.stderr.write(
-                        "Warn: your table has too many columns, only output partial result.\n"
-                    )
+                # find index of next free cell, and insert spanID
+                next_free = _next_free_index(current_row, next_free)
+                current_row[next_free] = MyTableCell(
+                    None, "span", span_id=current_span_id)
+                span_indexes.append(next_free)
             # If current is leading span cell, save other cells in same span
             # unit into pending_no_leader_span_cells
             for x in range(rowspan - 1):
-                for y in range(colspan):
-                    logger.debug(
-                        "add (%d,%d,%s) to pending_no_leader_span_cells",
-                        i + x + 1, j + colspan_passed + y, current_span_id)
-                    pending_no_leader_span_cells.append(
-                        (i + x + 1, j + colspan_passed + y, current_span_id))
-            colspan_passed += colspan - 1
-    # shrink table_expand_spans
-    max_rows = 0
+                logger.debug(
+                    "add row %d, columns %s of span%d to "
+                    "pending_no_leader_span_cells", i + x + 1, span_indexes,
+                    current_span_id)
+                pending_no_leader_span_cells.setdefault(i + x + 1, []).extend(
+                    (index, current_span_id) for index in span_indexes)
+    # shrink table_expand_spans, table ends at the first empty row
+    max_rows = len(table_expand_spans)
     max_cols = 0
-    for i in range(MAX_TABLE_ROWS):
-        current_max_cols = 0
-        for j in range(MAX_TABLE_COLS):
-            if table_expand_spans[i][j] is not None:
-                current_max_cols += 1
-        if current_max_cols == 0:  # if entire row are None
+    for i, row in enumerate(table_expand_spans):
+        if not row:  # if entire row are None
             max_rows = i
             break
-        if i == MAX_TABLE_ROWS - 1:
-            sys.stderr.write(
-                "Warn: your table has too many rows, only output partial result.\n"
-            )
-            max_rows = MAX_TABLE_ROWS
-            break
-        if current_max_cols > max_cols:
-            max_cols = current_max_cols
+        if len(row) > max_cols:
+            max_cols = len(row)
     logger.debug("max_rows=%d, max_cols=%d", max_rows, max_cols)
-    shrinked = [table_expand_spans[i][0:max_cols] for i in range(max_rows)]
+    shrinked = table_expand_spans[0:max_rows]
     # If there is None cell in shrinked, change it to MyTableCell("", "none")
     # Following table is an example of this case
     # <table border="1">
@@ -398,15 +770,41 @@ def gen_expand_table(origtable):
     # </tr>
     # </table>
     for column in shrinked:
+        column.extend([None] * (max_cols - len(column)))
         for j, elem in enumerate(column):
             if elem is None:
                 column[j] = MyTableCell("", "none")
     return shrinked
 
 
+def _next_free_index(row, start):
+    """ Return index of first None cell in row at or after start, row is
+    extended by one None cell if there is no such cell in it. As cells before
+    the returned index are all occupied, caller can pass it as start of next
+    search, so that placing all cells of a row is linear. """
+    while start < len(row) and row[start] is not None:
+        start += 1
+    if start == len(row):
+        row.append(None)
+    return start
+
+
+def _set_cell(row, index, cell):
+    """ Set row[index] to cell, row is extended by None cells if it is shorter
+    than index. """
+    if index >= len(row):
+        row.extend([None] * (index + 1 - len(row)))
+    row[index] = cell
+
+
+def gen_span_id_matrix(table):
+    """ Return matrix of span id of each cell in table """
+    return [[cell.span_id for cell in row] for row in table]
+
+
 def is_span_cell(cell):
     """ Return true if cell has span type"""
-    return cell.cell_type.startswith("span")
+    return cell.span_id != 0
 
 
 def is_leader_span_cell(cell):
@@ -423,46 +821,75 @@ def is_leader_span_cell(cell):
      leader      continue    continue
     span cell    span cell   span cell
     """
-    return cell.cell_type.startswith("span") and cell.data is not None
-
-
-def is_continue_span_cell(cell):
-    """ Return true if cell is span cell but not leader span cell"""
-    return cell.cell_type.startswith("span") and cell.data is None
-
+    return cell.span_id != 0 and cell.data is not None
 
-def is_same_span_id(cell1, cell2):
-    """ Return true is cell1 and cell2 in same span"""
-    return is_span_cell(cell1) and is_span_cell(cell2) \
-           and cell1.cell_type == cell2.cell_type
 
-
-def gen_output_cols_width(expand_table, output_style, align_in_tty):
-    """ Compute the width of each col that can hold cell data"""
-    assert output_style in ['emacs', 'orgmode', 'mysql', 'markdown']
+def gen_cell_metrics(table, output_style, align_in_tty):
+    """ Measure each cell in table once for given output style. Return a matrix
+    in same shape of table, each item is a tuple:
+      (data_width, num_of_vert_bar, output_data, output_data_width)
+    output_data is cell data with | escaped for orgmode/markdown style. The item
+    is None for continue span cell, which has no data.
+    """
+    escaped = RENDERERS[output_style].escaped_vert_bar
+    extra_width = len(escaped) - len('|') if escaped else 0
+    # Measure all cells in terminal in one batch, rather than one by one
+    term_widths = measure_cells_in_term(
+        (cell.data for row in table for cell in row if cell.data is not None),
+        align_in_tty)
+    metrics = []
+    for row in table:
+        row_metrics = []
+        for cell in row:
+            data = cell.data
+            if data is None:
+                row_metrics.append(None)
+                continue
+            if term_widths is None:
+                data_width = width(data, align_in_tty)
+            else:
+                data_width = term_widths[to_unicode(data)]
+            num_of_vert_bar = data.count('|') if escaped else 0
+            if num_of_vert_bar:
+                row_metrics.append(
+                    (data_width, num_of_vert_bar, data.replace('|', escaped),
+                     data_width + extra_width * num_of_vert_bar))
+            else:
+                row_metrics.append((data_width, 0, data, data_width))
+        metrics.append(row_metrics)
+    return metrics
+
+
+def gen_output_cols_width(expand_table,
+                          output_style,
+                          align_in_tty,
+                          metrics=None):
+    """ Compute the width of each col that can hold cell data. metrics is the
+    result of gen_cell_metrics, it's computed if not given. """
+    assert output_style in RENDERERS
     if not expand_table:
         return []
+    if metrics is None:
+        metrics = gen_cell_metrics(expand_table, output_style, align_in_tty)
     num_cols = len(expand_table[0])
     cols_max_width = [0 for _ in range(num_cols)]  # 0 repeated num_cols times
     leader_cells_colspan_ge_2 = []
     for i, _ in enumerate(expand_table):
         for j, _ in enumerate(expand_table[i]):
             if is_leader_span_cell(expand_table[i][j]):
-                if expand_table[i][j].get_colspan() == 1:
-                    if width(expand_table[i][j].data,
-                             align_in_tty) > cols_max_width[j]:
-                        cols_max_width[j] = width(expand_table[i][j].data,
-                                                  align_in_tty)
+                if expand_table[i][j].colspan == 1:
+                    data_width = metrics[i][j][0]
+                    if data_width > cols_max_width[j]:
+                        cols_max_width[j] = data_width
                 else:
                     leader_cells_colspan_ge_2.append(
-                        (i, j, expand_table[i][j].get_colspan()))
+                        (i, j, expand_table[i][j].colspan))
             if not is_span_cell(expand_table[i][j]):
-                assert expand_table[i][j].get_colspan() == 1, \
+                assert expand_table[i][j].colspan == 1, \
                     "Colspan must be 1 in normal cell"
-                if width(expand_table[i][j].data,
-                         align_in_tty) > cols_max_width[j]:
-                    cols_max_width[j] = width(expand_table[i][j].data,
-                                              align_in_tty)
+                data_width = metrics[i][j][0]
+                if data_width > cols_max_width[j]:
+                    cols_max_width[j] = data_width
     logger.debug("leader_cells_colspan_ge_2=%s", leader_cells_colspan_ge_2)
     spans = [x[2] for x in leader_cells_colspan_ge_2]  # x[2] is colspan value
     spans = sorted(set(spans))
@@ -475,16 +902,14 @@ def gen_output_cols_width(expand_table, output_style, align_in_tty):
             if output_style == 'emacs':
                 spans_widths = cols_max_width[ind_j:ind_j + span]
                 total_width = sum(spans_widths) + (span - 1) * len(" | ")
-                width_diff = total_width - \
-                             width(expand_table[ind_i][ind_j].data, align_in_tty)
+                width_diff = total_width - metrics[ind_i][ind_j][0]
                 # If content is span is to long, increase width of last cell
                 # in same span
                 if width_diff < 0:
                     logger.debug("width_diff=%d", width_diff)
                     cols_max_width[ind_j + span - 1] += -width_diff
             else:
-                width_diff = cols_max_width[ind_j] - \
-                             width(expand_table[ind_i][ind_j].data, align_in_tty)
+                width_diff = cols_max_width[ind_j] - metrics[ind_i][ind_j][0]
                 # If content is span is to long, increase width of first cell
                 # in same span
                 if width_diff < 0:
@@ -494,294 +919,824 @@ def gen_output_cols_width(expand_table, output_style, align_in_tty):
     return cols_max_width
 
 
-def output_emacs_table(table, cols_max_width, column_align, align_in_tty):
-    if not table:
-        return ""
-    alignment = ['l' for _ in range(MAX_TABLE_COLS)]  # default is left align
+def gen_alignment(column_align, num_cols):
+    """ Return list of align char of each column, default is left align """
+    alignment = ['l' for _ in range(num_cols)]
     if column_align:
-        if len(column_align) > MAX_TABLE_COLS:
-            column_align = column_align[0:MAX_TABLE_COLS]
-        for index, item in enumerate(column_align):
+        for index, item in enumerate(column_align[0:num_cols]):
             alignment[index] = item
-    out_str = ''
-    for i, _ in enumerate(table):
-        # output horizontal line
-        for j, _ in enumerate(table[i]):
+    return alignment
+
+
+class TableLayout(object):
+    """ A renderer compiled for given width and alignment of columns. Border
+    lines and blank cells are computed once, then each row is rendered with
+    them. See TableRenderer.compile. """
+
+    def __init__(self, renderer, cols_width, alignment):
+        for align in alignment:
+            if align not in ('l', 'r'):
+                raise Exception(
+                    'Found invalid column align char {0}'.format(align))
+        self.cols_width = cols_width
+        self.right_aligned = [align == 'r' for align in alignment]
+        self.top = renderer.gen_border(renderer.top, cols_width)
+        self.header = renderer.gen_border(renderer.header, cols_width)
+        self.separator = renderer.gen_border(renderer.separator, cols_width)
+        self.bottom = renderer.gen_border(renderer.bottom, cols_width)
+        # Horizontal part of border and blank content of each column
+        self.dashes = ["-" * (1 + w + 1) for w in cols_width]
+        self.blanks = [" " * (1 + w + 1) for w in cols_width]
+        self.blank_cells = ["|" + blank for blank in self.blanks]
+
+    def line_before_row(self, i, no_header):
+        """ Return border line before row i, or None """
+        if i == 0:
+            return self.top
+        if i == 1 and self.header is not None and not no_header:
+            return self.header
+        return self.separator
+
+    def format_row(self, row_metrics):
+        """ Return content line of a row, row_metrics is list of cell metrics
+        (see gen_cell_metrics), a cell is blank if its metrics is None. """
+        cols_width = self.cols_width
+        right_aligned = self.right_aligned
+        parts = []
+        for j, cell_metrics in enumerate(row_metrics):
+            if cell_metrics is None:
+                parts.append(self.blank_cells[j])
+                continue
+            data = cell_metrics[2]
+            pad = " " * (cols_width[j] - cell_metrics[3])
+            if right_aligned[j]:
+                parts.append("| " + pad + data + " ")
+            else:
+                parts.append("| " + data + pad + " ")
+        parts.append("|\n")
+        return "".join(parts)
+
+
+# Maximum number of compiled layouts cached by each renderer
+LAYOUT_CACHE_SIZE = 64
+
+
+class TableRenderer(object):
+    """ Renderer of an output style. A style is defined by its name, the
+    escaped string of | in cell data, and its border lines, each of them is a
+    tuple of (left, middle, right) junction chars, or None if the line is not
+    output:
+      top: line above the first row
+      header: line under the first row (header), not output if no_header
+      separator: line between two rows, header is used under the first row
+                 if it's not None
+      bottom: line under the last row
+    Subclass it and call register_renderer to add a new style.
+    """
+    name = None
+    escaped_vert_bar = None
+    top = None
+    header = None
+    separator = None
+    bottom = None
+
+    def __init__(self):
+        self._layouts = {}
+
+    @staticmethod
+    def gen_border(junctions, cols_width):
+        """ Return border line of given junction chars, or None """
+        if junctions is None:
+            return None
+        left, middle, right = junctions
+        return left + middle.join("-" * (1 + w + 1)
+                                  for w in cols_width) + right + "\n"
+
+    def compile(self, cols_width, column_align):
+        """ Return TableLayout of given width of columns and align string of
+        columns. The layout is cached, tables which share widths reuse it. """
+        key = (tuple(cols_width), column_align)
+        layout = self._layouts.get(key)
+        if layout is None:
+            if len(self._layouts) >= LAYOUT_CACHE_SIZE:
+                self._layouts.clear()
+            layout = TableLayout(self, list(cols_width),
+                                 gen_alignment(column_align, len(cols_width)))
+            self._layouts[key] = layout
+        return layout
+
+    def gen_cols_width(self, cols_max_width, metrics):
+        """ Return width of columns for rendering, it includes extra width of
+        escaped | in cells. """
+        if not self.escaped_vert_bar:
+            return cols_max_width
+        nums_of_vert_bar = [0] * len(cols_max_width)
+        for row_metrics in metrics:
+            for j, cell_metrics in enumerate(row_metrics):
+                if cell_metrics is not None:
+                    count = cell_metrics[1]
+                    if count > nums_of_vert_bar[j]:
+                        nums_of_vert_bar[j] = count
+        multi = len(self.escaped_vert_bar)
+        return [a + multi * b for a, b in zip(cols_max_width, nums_of_vert_bar)]
+
+    def iter_table_lines(self,
+                         table,
+                         cols_max_width,
+                         column_align,
+                         no_header,
+                         align_in_tty,
+                         metrics=None):
+        """ Generate lines of table one by one, each line is ended with a
+        newline. Data of leader span cell is output in its first column,
+        other cells of the span are blank. metrics is the result of
+        gen_cell_metrics, it's computed if not given. """
+        if not table:
+            return
+        if metrics is None:
+            metrics = gen_cell_metrics(table, self.name, align_in_tty)
+        layout = self.compile(self.gen_cols_width(cols_max_width, metrics),
+                              column_align)
+        for i, row_metrics in enumerate(metrics):
+            line = layout.line_before_row(i, no_header)
+            if line is not None:
+                yield line
+            yield layout.format_row(row_metrics)
+        if layout.bottom is not None:
+            yield layout.bottom
+
+
+class OrgmodeRenderer(TableRenderer):
+    r""" An example of orgmode style, | in cell is converted to \vert:
+    | Name  | Phone | Age |
+    |-------+-------+-----|
+    | Peter |  1234 |  17 |
+    | Anna  |  4321 |  25 |
+    """
+    name = 'orgmode'
+    escaped_vert_bar = '\\vert'
+    header = ('|', '+', '|')
+
+
+class MysqlRenderer(TableRenderer):
+    """ An example of mysql style:
+    +-------+-------+-----+
+    | Name  | Phone | Age |
+    +-------+-------+-----+
+    | Peter |  1234 |  17 |
+    | Anna  |  4321 |  25 |
+    +-------+-------+-----+
+    """
+    name = 'mysql'
+    top = header = bottom = ('+', '+', '+')
+
+
+class MarkdownRenderer(TableRenderer):
+    r""" An example of markdown style, | in cell is converted to \|:
+    | Name  | Phone | Age |
+    |-------|-------|-----|
+    | Peter |  1234 |  17 |
+    | Anna  |  4321 |  25 |
+    """
+    name = 'markdown'
+    escaped_vert_bar = '\\|'
+    header = ('|', '|', '|')
+
+
+class EmacsRenderer(TableRenderer):
+    """ Emacs style, there is a border line between any two rows, cells in a
+    span are merged into one cell. For example:
+    +-------+-------+-----+
+    | Name  | Phone | Age |
+    +-------+-------+-----+
+    | Peter | 1234        |
+    +-------+-------+-----+
+    """
+    name = 'emacs'
+    top = separator = bottom = ('+', '+', '+')
+
+    def iter_table_lines(self,
+                         table,
+                         cols_max_width,
+                         column_align,
+                         no_header,
+                         align_in_tty,
+                         metrics=None):
+        """ Generate lines of table one by one, each line is ended with a
+        newline. Rows without spans are rendered by compiled layout, border
+        lines and content of rows with spans are computed from span ids.
+        no_header is ignored, header is always separated by a border line. """
+        if not table:
+            return
+        if metrics is None:
+            metrics = gen_cell_metrics(table, self.name, align_in_tty)
+        layout = self.compile(cols_max_width, column_align)
+        # Span id of each cell, 0 means cell is not in any span. Two cells are
+        # in same span if they have same non-zero span id.
+        span_ids = gen_span_id_matrix(table)
+        has_spans = [any(ids) for ids in span_ids]
+        for i, row in enumerate(table):
+            prev_has_span = i > 0 and has_spans[i - 1]
+            if not prev_has_span and not has_spans[i]:
+                yield layout.line_before_row(i, no_header)
+            else:
+                yield self.gen_span_border(layout, span_ids, i)
+            if not has_spans[i]:
+                yield layout.format_row(metrics[i])
+            else:
+                yield self.format_span_row(layout, row, metrics[i], span_ids,
+                                           i)
+        if not has_spans[-1]:
+            yield layout.bottom
+        else:
+            # output last line of current table
+            last_ids = span_ids[-1]
+            out_str = ''
+            for j, dashes in enumerate(layout.dashes):
+                if j > 0 and last_ids[j] and last_ids[j - 1] == last_ids[j]:
+                    out_str += "-"
+                else:
+                    out_str += "+"
+                out_str += dashes
+            yield out_str + "+\n"
+
+    @staticmethod
+    def gen_span_border(layout, span_ids, i):
+        """ Return border line above row i, row i or row i-1 has span """
+        cur_ids = span_ids[i]
+        prev_ids = span_ids[i - 1] if i > 0 else None
+        out_str = ''
+        for j, cur_id in enumerate(cur_ids):
             # output first character in horizontal line
             if i == 0:  # first row
-                if j > 0 and is_same_span_id(table[i][j - 1], table[i][j]):
+                if j > 0 and cur_id and cur_ids[j - 1] == cur_id:
                     out_str += "-"
                 else:
                     out_str += "+"
             else:
                 if j == 0:  # first col
-                    if is_same_span_id(table[i - 1][j], table[i][j]):
+                    if cur_id and prev_ids[j] == cur_id:
                         out_str += "|"
                     else:
                         out_str += "+"
                 else:  # here, i>0, j>0
-                    if is_same_span_id(table[i - 1][j - 1], table[i][j]):
+                    if cur_id and prev_ids[j - 1] == cur_id:
                         out_str += " "
-                    elif is_same_span_id(table[i - 1][j - 1], table[i - 1][j]) \
-                         and is_same_span_id(table[i][j - 1], table[i][j]):
+                    elif prev_ids[j] and prev_ids[j - 1] == prev_ids[j] \
+                         and cur_id and cur_ids[j - 1] == cur_id:
                         out_str += "-"
                     else:
                         out_str += "+"
-            if i > 0 and is_same_span_id(table[i - 1][j], table[i][j]):
-                out_str += " " * (1 + cols_max_width[j] + 1)
+            if i > 0 and cur_id and prev_ids[j] == cur_id:
+                out_str += layout.blanks[j]
             else:
-                out_str += "-" * (1 + cols_max_width[j] + 1)
+                out_str += layout.dashes[j]
         # last character in horizontal line
-        if i > 0 and is_same_span_id(table[i - 1][len(table[i]) - 1],
-                                     table[i][len(table[i]) - 1]):
+        if i > 0 and cur_ids[-1] and prev_ids[-1] == cur_ids[-1]:
             out_str += "|\n"
         else:
             out_str += "+\n"
-        # output content
-        for j, _ in enumerate(table[i]):
+        return out_str
+
+    @staticmethod
+    def format_span_row(layout, row, row_metrics, span_ids, i):
+        """ Return content line of row i which has span """
+        cur_ids = span_ids[i]
+        prev_ids = span_ids[i - 1] if i > 0 else None
+        cols_width = layout.cols_width
+        out_str = ''
+        for j, cur_id in enumerate(cur_ids):
             # output first character
             if j == 0:
                 out_str += "|"
-            else:  # j > 0
-                if i == 0:
-                    if is_same_span_id(table[i][j - 1], table[i][j]):
-                        # output nothing, there is leading span in previous cell
-                        pass
-                    else:
-                        out_str += "|"
-                else:  # i > 0
-                    if is_same_span_id(table[i][j - 1], table[i][j]):
-                        if is_same_span_id(table[i - 1][j], table[i][j]):
-                            out_str += " "
-                        else:
-                            # output nothing, there is leading span in previous cell
-                            pass
-                    else:
-                        out_str += "|"
-            if not is_span_cell(table[i][j]):
-                data_width = width(table[i][j].data, align_in_tty)
-                diff = cols_max_width[j] - data_width
-                if alignment[j] == 'l':
-                    content = " " + table[i][j].data + " " * diff + " "
-                elif alignment[j] == 'r':
-                    content = " " + " " * diff + table[i][j].data + " "
-                else:
-                    raise Exception(
-                        'Found invalid column align char {0}'.format(
-                            alignment[j]))
-                # logger.debug("normal cell[%d][%d] content=[%s]", i, j, content)
-                out_str += content
-            elif is_leader_span_cell(table[i][j]):
-                data_width = width(table[i][j].data, align_in_tty)
-                cell_colspan = table[i][j].get_colspan()
-                cell_width = sum(cols_max_width[j:j + cell_colspan]) + \
+            elif cur_id and cur_ids[j - 1] == cur_id:
+                if i > 0 and prev_ids[j] == cur_id:
+                    out_str += " "
+                # else output nothing, there is leading span in previous cell
+            else:
+                out_str += "|"
+            if not cur_id:
+                cell_width = cols_width[j]
+            elif row[j].data is not None:  # leader span cell
+                cell_colspan = row[j].colspan
+                cell_width = sum(cols_width[j:j + cell_colspan]) + \
                              len("   ") * (cell_colspan - 1)
-                diff = cell_width - data_width
-                # logger.debug("cell_colspan=[%s]", cell_colspan)
-                # logger.debug("cell_width=[%s]", cell_width)
-                # logger.debug("diff=[%s]", diff)
-                if alignment[j] == 'l':
-                    content = " " + table[i][j].data + " " * diff + " "
-                elif alignment[j] == 'r':
-                    content = " " + " " * diff + table[i][j].data + " "
-                else:
-                    raise Exception(
-                        'Found invalid column align char {0}'.format(
-                            alignment[j]))
-                out_str += content
-            elif i > 0 and is_same_span_id(table[i - 1][j], table[i][j]):
-                # output empty string for rowspan
-                out_str += " " + " " * cols_max_width[j] + " "
-        out_str += "|\n"
-    # output last line of current table
-    last_row = len(table) - 1
-    for j, _ in enumerate(table[0]):
-        if j > 0 and is_same_span_id(table[last_row][j - 1],
-                                     table[last_row][j]):
-            out_str += "-"
-        else:
-            out_str += "+"
-        out_str += "-" * (1 + cols_max_width[j] + 1)
-    out_str += "+\n"
-    return out_str
+            else:
+                if i > 0 and prev_ids[j] == cur_id:
+                    # output empty string for rowspan
+                    out_str += layout.blanks[j]
+                continue
+            diff = cell_width - row_metrics[j][0]
+            if layout.right_aligned[j]:
+                out_str += " " + " " * diff + row[j].data + " "
+            else:
+                out_str += " " + row[j].data + " " * diff + " "
+        return out_str + "|\n"
 
 
-def output_other_table(table, cols_max_width, output_style, column_align,
-                       no_header, align_in_tty):
-    r""" Output table to orgmode or mysql or markdown style.
-    An example of orgmode style:
-    | Name  | Phone | Age |
-    |-------+-------+-----|
-    | Peter |  1234 |  17 |
-    | Anna  |  4321 |  25 |
+# Renderers of output styles, keyed by style name
+RENDERERS = OrderedDict()
 
-    An example of mysql style:
-    +-------+-------+-----+
-    | Name  | Phone | Age |
-    +-------+-------+-----+
-    | Peter |  1234 |  17 |
-    | Anna  |  4321 |  25 |
-    +-------+-------+-----+
 
-    An example of markdown style:
-    | Name  | Phone | Age |
-    |-------|-------|-----|
-    | Peter |  1234 |  17 |
-    | Anna  |  4321 |  25 |
+def register_renderer(renderer):
+    """ Register renderer (instance of TableRenderer subclass) as output style
+    renderer.name, it replaces the registered renderer of same name. """
+    RENDERERS[renderer.name] = renderer
+
+
+def unregister_renderer(name):
+    """ Remove output style name added by register_renderer, return its
+    renderer. Raise KeyError if name is not registered. """
+    return RENDERERS.pop(name)
+
+
+for _renderer_class in (OrgmodeRenderer, EmacsRenderer, MysqlRenderer,
+                        MarkdownRenderer):
+    register_renderer(_renderer_class())
+
+
+def iter_emacs_table_lines(table,
+                           cols_max_width,
+                           column_align,
+                           align_in_tty,
+                           metrics=None):
+    """ Generate lines of emacs style table one by one, each line is ended
+    with a newline. metrics is the result of gen_cell_metrics, it's computed
+    if not given. """
+    return RENDERERS['emacs'].iter_table_lines(table, cols_max_width,
+                                               column_align, False,
+                                               align_in_tty, metrics)
+
+
+def output_emacs_table(table,
+                       cols_max_width,
+                       column_align,
+                       align_in_tty,
+                       metrics=None):
+    """ Output table to emacs style, see iter_emacs_table_lines for details """
+    return "".join(
+        iter_emacs_table_lines(table, cols_max_width, column_align,
+                               align_in_tty, metrics))
+
+
+def iter_other_table_lines(table,
+                           cols_max_width,
+                           output_style,
+                           column_align,
+                           no_header,
+                           align_in_tty,
+                           metrics=None):
+    """ Generate lines of table in output_style other than emacs one by one,
+    for example orgmode, mysql or markdown, see their renderers for examples.
+    Each line is ended with a newline.
 
     Note:
     Character | in cell will be escaped for orgmode/markdown style
-    In orgmode table:  convert | to \vert
-    In markdown table: convert | to \|
+    In orgmode table:  convert | to \\vert
+    In markdown table: convert | to \\|
+
+    metrics is the result of gen_cell_metrics, it's computed if not given.
     """
-    assert output_style in ['orgmode', 'mysql', 'markdown']
-    if not table:
-        return ""
-    cols_max_width_new = list(cols_max_width)  # copy list
-    if output_style == 'mysql':
-        pass  # No escaping for |
-    else:
-        # Compute number of | in each column, we will escape it
-        num_cols = len(table[0])
-        nums_of_vert_bar = [0 for _ in range(num_cols)]
-        for i, _ in enumerate(table):
-            for j, _ in enumerate(table[i]):
-                if is_leader_span_cell(
-                        table[i][j]) or not is_span_cell(table[i][j]):
-                    count = table[i][j].data.count('|')
-                    if count > nums_of_vert_bar[j]:
-                        nums_of_vert_bar[j] = count
-        if output_style == 'orgmode':
-            escaped = '\\vert'
-        elif output_style == 'markdown':
-            escaped = '\\|'
+    assert output_style in RENDERERS and output_style != 'emacs'
+    return RENDERERS[output_style].iter_table_lines(table, cols_max_width,
+                                                    column_align, no_header,
+                                                    align_in_tty, metrics)
+
+
+def output_other_table(table,
+                       cols_max_width,
+                       output_style,
+                       column_align,
+                       no_header,
+                       align_in_tty,
+                       metrics=None):
+    """ Output table to orgmode or mysql or markdown style, see
+    iter_other_table_lines for details. """
+    return "".join(
+        iter_other_table_lines(table, cols_max_width, output_style,
+                               column_align, no_header, align_in_tty, metrics))
+
+
+# Appended to cell data truncated by overflow policy 'truncate'
+OVERFLOW_MARKER = '~'
+# How to output cell data wider than its column: 'truncate' cuts it and appends
+# OVERFLOW_MARKER, 'stretch' outputs it as is and the cell stretches past the
+# border of its column.
+OVERFLOW_POLICIES = ['truncate', 'stretch']
+
+
+def truncate_to_width(s, max_width, align_in_tty, vert_bar_width=1):
+    """ Truncate string s and append OVERFLOW_MARKER, so that its width is not
+    larger than max_width. Char | is considered as vert_bar_width width, as it
+    would be escaped in orgmode and markdown style. """
+    budget = max_width - len(OVERFLOW_MARKER)
+    if budget < 0:
+        return ''
+    total = 0
+    for index, ch in enumerate(s):
+        ch_width = vert_bar_width if ch == '|' else width(ch, align_in_tty)
+        if total + ch_width > budget:
+            return s[:index] + OVERFLOW_MARKER
+        total += ch_width
+    return s
+
+
+def gen_plain_cols_width(rows, output_style, align_in_tty, cells_width=None):
+    """ Compute the width of each col that can hold cell data, rows are list
+    of strings without spans, for example rows of csv. | in cell data would
+    be escaped for orgmode and markdown style, the width of columns include
+    the extra width of it. Width of each cell is appended to cells_width if
+    it's not None, see iter_plain_table_lines. """
+    escaped = RENDERERS[output_style].escaped_vert_bar
+    # Measure all cells in terminal in one batch, rather than one by one
+    term_widths = measure_cells_in_term(
+        (data for row in rows for data in row), align_in_tty)
+    cols_max_width = []
+    nums_of_vert_bar = []
+    for row in rows:
+        if len(row) > len(cols_max_width):
+            extra_cols = len(row) - len(cols_max_width)
+            cols_max_width.extend([0] * extra_cols)
+            nums_of_vert_bar.extend([0] * extra_cols)
+        for j, data in enumerate(row):
+            if term_widths is None:
+                data_width = width(data, align_in_tty)
+            else:
+                data_width = term_widths[to_unicode(data)]
+            if cells_width is not None:
+                cells_width.append(data_width)
+            if data_width > cols_max_width[j]:
+                cols_max_width[j] = data_width
+            if escaped:
+                count = data.count('|')
+                if count > nums_of_vert_bar[j]:
+                    nums_of_vert_bar[j] = count
+    if escaped:
         multi = len(escaped)
-        cols_max_width_new = \
+        cols_max_width = \
             [a + multi * b for a, b in zip(cols_max_width, nums_of_vert_bar)]
+    logger.debug("cols_max_width=%s", cols_max_width)
+    return cols_max_width
 
-    alignment = ['l' for _ in range(MAX_TABLE_COLS)]  # default is left align
-    if column_align:
-        if len(column_align) > MAX_TABLE_COLS:
-            column_align = column_align[0:MAX_TABLE_COLS]
-        for index, item in enumerate(column_align):
-            alignment[index] = item
-    out_str = ''
-    for i, _ in enumerate(table):
-        if i == 0 and output_style == 'mysql':
-            # first horizontal line for mysql style
-            for j, _ in enumerate(table[i]):
-                if j == 0:
-                    out_str += "+"
-                else:
-                    out_str += "+"
-                out_str += "-" * (1 + cols_max_width_new[j] + 1)
-            out_str += "+\n"
-        if no_header:
-            pass
-        else:
-            if i == 1:
-                # output horizontal line
-                for j, _ in enumerate(table[i]):
-                    if j == 0:  # first character in horizontal line
-                        if output_style == 'orgmode':
-                            out_str += "|"
-                        elif output_style == 'mysql':
-                            out_str += "+"
-                        elif output_style == 'markdown':
-                            out_str += "|"
+
+def iter_plain_table_lines(rows,
+                           cols_width,
+                           output_style,
+                           column_align,
+                           no_header,
+                           align_in_tty,
+                           overflow='stretch',
+                           cells_width=None):
+    """ Generate lines of table one by one, rows are list of strings without
+    spans, for example rows of csv. Each row is output as soon as it's taken
+    from rows, so rows can be a generator of endless rows. cells_width is
+    width of each cell in rows, as computed by gen_plain_cols_width, width of
+    cells is computed again if it's None.
+
+    The width of columns are given by cols_width, cell data wider than its
+    column is handled by overflow policy, see OVERFLOW_POLICIES. Rows shorter
+    than cols_width are padded with empty cells, extra cells of longer rows are
+    output in their own width.
+    """
+    assert output_style in RENDERERS
+    assert overflow in OVERFLOW_POLICIES
+    escaped = RENDERERS[output_style].escaped_vert_bar
+    extra_width = len(escaped) - len('|') if escaped else 0
+    num_cols = len(cols_width)
+    layout = RENDERERS[output_style].compile(cols_width, column_align)
+    if cells_width is not None:
+        cells_width = iter(cells_width)
+    i = -1
+    for i, row in enumerate(rows):
+        line = layout.line_before_row(i, no_header)
+        if line is not None:
+            yield line
+        num_data = len(row)
+        if num_data < num_cols:
+            row = list(row) + [''] * (num_cols - num_data)
+        term_widths = None
+        if cells_width is None:
+            # Measure cells of the row in terminal in one batch
+            term_widths = measure_cells_in_term(row, align_in_tty)
+        out_str = ''
+        for j, data in enumerate(row):
+            data = to_unicode(data)
+            if cells_width is not None and j < num_data:
+                data_width = next(cells_width)
+            elif term_widths is not None:
+                data_width = term_widths[data]
+            else:
+                data_width = width(data, align_in_tty)
+            if escaped:
+                count = data.count('|')
+                if count:
+                    data = data.replace('|', escaped)
+                    data_width += extra_width * count
+            if j >= num_cols:
+                col_width = data_width
+                right_aligned = False
+            else:
+                col_width = cols_width[j]
+                right_aligned = layout.right_aligned[j]
+                if data_width > col_width and overflow == 'truncate':
+                    if escaped:  # truncate original data, then escape it
+                        data = truncate_to_width(
+                            data.replace(escaped, '|'), col_width,
+                            align_in_tty, len(escaped)).replace('|', escaped)
                     else:
-                        if output_style == 'orgmode':
-                            out_str += "+"
-                        elif output_style == 'mysql':
-                            out_str += "+"
-                        elif output_style == 'markdown':
-                            out_str += "|"
-                    out_str += "-" * (1 + cols_max_width_new[j] + 1)
-                # last character and newline in horizontal line
-                if output_style == 'orgmode':
-                    out_str += "|\n"
-                elif output_style == 'mysql':
-                    out_str += "+\n"
-                elif output_style == 'markdown':
-                    out_str += "|\n"
-        # output content
-        for j, _ in enumerate(table[i]):
-            out_str += "|"
-            if is_continue_span_cell(table[i][j]):
-                content = " " + " " * cols_max_width_new[j] + " "
-                out_str += content
+                        data = truncate_to_width(data, col_width, align_in_tty)
+                    data_width = width(data, align_in_tty)
+            pad = " " * (col_width - data_width)
+            if right_aligned:
+                out_str += "| " + pad + data + " "
             else:
-                if output_style == 'mysql':
-                    data_new = table[i][j].data
-                else:
-                    data_new = table[i][j].data.replace("|", escaped)
-                data_width = width(data_new, align_in_tty)
-                diff = cols_max_width_new[j] - data_width
-                if alignment[j] == 'l':
-                    content = " " + data_new + " " * diff + " "
-                elif alignment[j] == 'r':
-                    content = " " + " " * diff + data_new + " "
-                else:
-                    raise Exception(
-                        'Found invalid column align char {0}'.format(
-                            alignment[j]))
-                out_str += content
+                out_str += "| " + data + pad + " "
         out_str += "|\n"
-        if i == len(table) - 1 and output_style == 'mysql':
-            # last horizontal line for mysql style
-            for j, _ in enumerate(table[i]):
-                if j == 0:
-                    out_str += "+"
-                else:
-                    out_str += "+"
-                out_str += "-" * (1 + cols_max_width_new[j] + 1)
-            out_str += "+\n"
-    return out_str
+        yield out_str
+    if i >= 0 and layout.bottom is not None:
+        yield layout.bottom
 
 
-def gen_table_from_csv(csv_content, csv_delimiter):
-    lines = csv_content.splitlines()
-    data = csv.reader(lines, delimiter=csv_delimiter)
-    ret_table = []
-    el_num_each_rows = [0] * len(lines)  # 0 repeated len(lines) times
-    for i, row in enumerate(data):
-        current_row = []
-        if row:
-            for element in row:
-                element = to_unicode(element)
-                current_row.append(MyTableCell(element, "csv"))
-                el_num_each_rows[i] = el_num_each_rows[i] + 1
-        ret_table.append(current_row)
-    el_min = min(el_num_each_rows)
-    el_max = max(el_num_each_rows)
-    if el_min == el_max:  # If each row has same number of elements
-        return ret_table
+try:
+    _timer = time.perf_counter
+except AttributeError:  # Python 2
+    _timer = time.time
+
+
+class ConversionStats(object):
+    """ Statistics of a conversion. Pass an instance as stats argument of
+    csv_2_ascii_table or html_2_ascii_table (or their iter_* variants) to
+    collect them, nothing is collected if stats is None.
+
+    Fields:
+      stages: OrderedDict maps stage name to its wall time in seconds. Stages
+              are 'parse', 'expand' (html only), 'width' and 'render', time of
+              nested stage is not counted in outer stage.
+      total_time: wall time from start of conversion to the last line.
+      tables: number of tables converted.
+      cells: number of cells in input tables.
+      width_calls: number of width() calls.
+      width_computed: number of width() calls missed in WIDTH_CACHE.
+      term_measures: number of strings measured in terminal.
+      bytes_in: size of input data in UTF-8.
+      bytes_out: size of output lines in UTF-8.
+      peak_memory: peak memory traced by tracemalloc in bytes, it's None if
+                   trace_memory is False or tracemalloc is not available.
+                   Tracing memory slows conversion down, and memory of worker
+                   processes is not traced.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = OrderedDict()
+        self.total_time = 0.0
+        self.tables = 0
+        self.cells = 0
+        self.width_calls = 0
+        self.width_computed = 0
+        self.term_measures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_memory = None
+        self._running = []  # stack of running stages
+        self._since = None  # time when the top running stage is resumed
+
+    def enter(self, stage):
+        """ Start timing stage, the running stage is paused until leave() """
+        now = _timer()
+        if self._running:
+            self._add_time(self._running[-1], now - self._since)
+        self._running.append(stage)
+        self._since = now
+
+    def leave(self):
+        """ Stop timing current stage, resume the paused one """
+        now = _timer()
+        self._add_time(self._running.pop(), now - self._since)
+        self._since = now
+
+    def _add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'stages': dict(self.stages),
+            'total_time': self.total_time,
+            'tables': self.tables,
+            'cells': self.cells,
+            'width_calls': self.width_calls,
+            'width_computed': self.width_computed,
+            'term_measures': self.term_measures,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'peak_memory': self.peak_memory,
+        }
+
+    def report(self):
+        """ Return statistics as human readable lines """
+        lines = ["total time: %.6fs" % self.total_time]
+        for stage, seconds in self.stages.items():
+            lines.append("  %-8s %.6fs" % (stage + ':', seconds))
+        lines.append("tables: %d, cells: %d" % (self.tables, self.cells))
+        lines.append("width() calls: %d, computed: %d, measured in " \
+                     "terminal: %d" % (self.width_calls, self.width_computed,
+                                       self.term_measures))
+        lines.append("bytes in: %d, bytes out: %d" %
+                     (self.bytes_in, self.bytes_out))
+        if self.peak_memory is not None:
+            lines.append("peak traced memory: %d bytes" % self.peak_memory)
+        return "\n".join(lines) + "\n"
+
+
+def _utf8_len(s):
+    """ Return size of string s in UTF-8 """
+    if isinstance(s, bytes):  # str of Python 2
+        return len(s)
+    return len(s.encode('utf-8'))
+
+
+def _timed_iter(iterable, stats, stage):
+    """ Generate items of iterable, time spent in iterable is added to stage
+    of stats. """
+    iterator = iter(iterable)
+    while True:
+        stats.enter(stage)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stats.leave()
+        yield item
+
+
+class CountingInput(object):
+    """ Wrap file-like input, size of data read from it is added to
+    stats.bytes_in. """
+
+    def __init__(self, input_file, stats):
+        self._input_file = input_file
+        self._stats = stats
+
+    def read(self, size=-1):
+        data = self._input_file.read(size)
+        self._stats.bytes_in += _utf8_len(data)
+        return data
+
+    def readline(self, size=-1):
+        line = self._input_file.readline(size)
+        self._stats.bytes_in += _utf8_len(line)
+        return line
+
+    def seekable(self):
+        return is_seekable(self._input_file)
+
+    def __iter__(self):
+        for line in self._input_file:
+            self._stats.bytes_in += _utf8_len(line)
+            yield line
+
+
+def _count_input(content, stats):
+    """ Return content which adds size of input data to stats.bytes_in as it's
+    read. content is string, file object, or iterable of string chunks or of
+    rows (list of strings). """
+    if _is_string(content):
+        stats.bytes_in += _utf8_len(content)
+        return content
+    if hasattr(content, 'read'):
+        return CountingInput(content, stats)
+    if _is_array(content):  # size of input is not counted
+        return content
+
+    def counted():
+        for item in content:
+            if _is_string(item):
+                stats.bytes_in += _utf8_len(item)
+            else:  # row
+                stats.bytes_in += sum(_utf8_len(x) for x in item)
+            yield item
+
+    if isinstance(content, list):
+        return list(counted())
+    return counted()
+
+
+def _count_cells(tables, stats):
+    """ Generate tables, number of tables and cells are added to stats """
+    for table in tables:
+        stats.tables += 1
+        stats.cells += sum(len(row) for row in table)
+        yield table
+
+
+def _count_row_cells(rows, stats):
+    """ Generate rows, number of cells are added to stats """
+    for row in rows:
+        stats.cells += len(row)
+        yield row
+
+
+def _iter_profiled(iter_func, content, args, stats):
+    """ Generate lines of iter_func(content, *args, stats), and collect
+    statistics of the conversion into stats. If stats is a callable rather
+    than ConversionStats, it's called with the collected ConversionStats when
+    the last line is generated. """
+    callback = None
+    if not isinstance(stats, ConversionStats):
+        callback, stats = stats, ConversionStats()
+    tracemalloc = None
+    if stats.trace_memory:
+        try:
+            import tracemalloc
+        except ImportError:  # Python 2
+            pass
+    started_tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    start = _timer()
+    with _PROFILED_CONVERSIONS_LOCK:
+        _PROFILED_CONVERSIONS[0] += 1
+    try:
+        lines = iter_func(_count_input(content, stats), *(args + (stats, )))
+        while True:
+            # stats is active only while the conversion runs, the generator
+            # may be resumed in another thread, e.g. by yatg.aio
+            previous = _ACTIVE_CONVERSION.stats
+            _ACTIVE_CONVERSION.stats = stats
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            finally:
+                _ACTIVE_CONVERSION.stats = previous
+            stats.bytes_out += _utf8_len(line)
+            yield line
+    finally:
+        with _PROFILED_CONVERSIONS_LOCK:
+            _PROFILED_CONVERSIONS[0] -= 1
+        stats.total_time += _timer() - start
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            stats.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+    if callback is not None:
+        callback(stats)
+
+
+# A line with its line ending, or the last line without line ending
+_LINE_RE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+def iter_lines(s):
+    """ Generate lines of string s one by one, line endings are kept. Unlike
+    s.splitlines(), s is not copied into a list of lines. """
+    for match in _LINE_RE.finditer(s):
+        yield match.group()
+
+
+def iter_file_lines(input_file):
+    """ Generate lines of file object input_file one by one. Builtin file of
+    python 2 reads ahead a block when it's iterated, which waits for more data
+    of a pipe, so its lines are read by readline() instead. """
+    if sys.version_info[0] < 3 and hasattr(input_file, 'readline'):
+        return iter(input_file.readline, '')
+    return iter(input_file)
+
+
+def to_cell_data(value):
+    """ Return unicode string of cell value, value which is not a string (for
+    example, number of database row) is converted by str(). """
+    if not _is_string(value):
+        value = str(value)
+    return to_unicode(value)
+
+
+def iter_csv_rows(csv_content, csv_delimiter):
+    """ Generate rows of csv one by one, each row is tuple of unicode strings.
+    csv_content can be string, file object or iterable of rows (list, tuple
+    or any sequence of cell values), for example list of lists, generator,
+    csv.reader or database cursor. String and file object are read by
+    csv.reader line by line, quoted fields can contain newlines. """
+    import csv
+    csv_delimiter = str(csv_delimiter)  # csv of python 2 rejects unicode
+    if _is_string(csv_content):
+        rows = csv.reader(iter_lines(csv_content), delimiter=csv_delimiter)
+    elif hasattr(csv_content, 'read'):  # file object
+        rows = csv.reader(iter_file_lines(csv_content),
+                          delimiter=csv_delimiter)
+    elif hasattr(csv_content, '__iter__'):
+        rows = csv_content
     else:
-        # Adjust bad format csv. For example, change:
-        # 1, 2
-        # A, B, C
-        # To:
-        # 1, 2, 3
-        # A, B, C
-        for i, row in enumerate(ret_table):
-            # append `el_max - len(row)` empty element
-            if len(row) < el_max:
-                extra = [MyTableCell("", "csv")] * (el_max - len(row))
-                ret_table[i].extend(extra)
-        return ret_table
-
-
-def gen_table_from_list(csv_content):
-    """ In order to reuse function output_emacs_table/output_other_table
-    We generate table contains cells with type MyTableCell"""
-    ret_table = []
-    for row in csv_content:
-        current_row = []
-        for col in row:
-            col = to_unicode(col)
-            current_row.append(MyTableCell(col, "csv"))
-        ret_table.append(current_row)
-    return ret_table
+        raise Exception("Unsupported csv_content type")
+    for row in rows:
+        # A string or bytes would be split into chars, and keys of a dict (for
+        # example a row of csv.DictReader) would be output as values
+        if _is_string(row) or isinstance(row, (bytes, bytearray, dict)):
+            raise Exception("Row of csv_content must be a sequence of cell " \
+                            "values, rather than a {0}".format(
+                                type(row).__name__))
+        yield tuple(to_cell_data(element) for element in row)
 
 
 def _is_string(data):
@@ -790,264 +1745,1396 @@ def _is_string(data):
     return isinstance(data, str)
 
 
+def _is_array(data):
+    """ Return true if data is an object of numpy or pandas """
+    return type(data).__module__.split('.')[0] in ('numpy', 'pandas')
+
+
+def gen_array_columns(data):
+    """ Return columns of pandas DataFrame or 2-D numpy array data, each is a
+    numpy array of unicode strings. First item of each column of DataFrame is
+    its column name, its index is not included. Return None if data is not a
+    DataFrame or numpy array, numpy and pandas are not imported for it. """
+    if not _is_array(data):
+        return None
+    np = import_optional('numpy')
+    if hasattr(data, 'columns'):  # DataFrame
+        return [
+            np.concatenate([
+                np.array([to_unicode(str(name))]),
+                data.iloc[:, j].astype(str).to_numpy(dtype=str)
+            ]) for j, name in enumerate(data.columns)
+        ]
+    if getattr(data, 'ndim', None) != 2:
+        raise Exception("Unsupported csv_content type, only DataFrame and " \
+                        "2-D array are supported")
+    # Transposed, so that each column is contiguous
+    return list(np.ascontiguousarray(np.asarray(data).astype(str).T))
+
+
+def gen_array_str_widths(column, align_in_tty):
+    """ Return widths of strings in numpy unicode array column as an integer
+    array. Width of each distinct non-ASCII char is computed once, rather
+    than width of each string. """
+    np = import_optional('numpy')
+    if align_in_tty or 'emoji' in get_width1_chars():
+        # Width depends on chars around, compute width of each distinct string
+        uniques, inverse = np.unique(column, return_inverse=True)
+        widths = [width(data, align_in_tty) for data in uniques.tolist()]
+        return np.array(widths, dtype=np.intp)[inverse.reshape(-1)]
+    if column.dtype.itemsize == 0:  # all strings are empty
+        return np.zeros(len(column), dtype=np.intp)
+    # Code points of each string, padded with 0
+    codes = column.view(np.uint32).reshape(len(column), -1)
+    widths = np.count_nonzero(codes, axis=1)
+    non_ascii = codes >= 0x80
+    if non_ascii.any():
+        uniques, inverse = np.unique(codes[non_ascii], return_inverse=True)
+        extra = np.array([char_width(_unichr(code)) - 1
+                          for code in uniques.tolist()], dtype=np.intp)
+        extra_widths = np.zeros(codes.shape, dtype=np.intp)
+        extra_widths[non_ascii] = extra[inverse]
+        widths += extra_widths.sum(axis=1)
+    return widths
+
+
+def iter_array_table_lines(columns, output_style, column_align, no_header,
+                           align_in_tty):
+    """ Generate lines of table of columns returned by gen_array_columns. Width
+    of columns, padding and lines are computed column by column with numpy,
+    no object is created for each cell. """
+    np = import_optional('numpy')
+    if not columns or not len(columns[0]):
+        return
+    escaped = RENDERERS[output_style].escaped_vert_bar
+    cols_width = []
+    cols_data = []
+    cols_pad = []
+    for column in columns:
+        data_widths = gen_array_str_widths(column, align_in_tty)
+        col_width = int(data_widths.max())
+        if escaped:
+            counts = np.char.count(column, '|')
+            if counts.any():
+                # Make room for escaped chars, replace() keeps the size of
+                # strings in some numpy versions
+                size = column.dtype.itemsize // 4 + \
+                    (len(escaped) - 1) * int(counts.max())
+                column = np.char.replace(column.astype('U%d' % size), '|',
+                                         escaped)
+                data_widths = data_widths + (len(escaped) - 1) * counts
+                col_width += len(escaped) * int(counts.max())
+        cols_width.append(col_width)
+        cols_data.append(column)
+        cols_pad.append(np.char.multiply(' ', col_width - data_widths))
+    logger.debug("cols_max_width=%s", cols_width)
+    layout = RENDERERS[output_style].compile(cols_width, column_align)
+    lines = None
+    for j, (data, pad) in enumerate(zip(cols_data, cols_pad)):
+        if layout.right_aligned[j]:
+            cells = np.char.add(pad, data)
+        else:
+            cells = np.char.add(data, pad)
+        if lines is None:
+            lines = np.char.add('| ', cells)
+        else:
+            lines = np.char.add(np.char.add(lines, ' | '), cells)
+    lines = np.char.add(lines, ' |\n')
+    for i, line in enumerate(lines.tolist()):
+        border = layout.line_before_row(i, no_header)
+        if border is not None:
+            yield border
+        yield line
+    if layout.bottom is not None:
+        yield layout.bottom
+
+
+def check_csv_layout(width_sample, overflow, column_widths):
+    """ Raise ValueError if width_sample, overflow or column_widths of csv
+    conversion is not valid, see csv_2_ascii_table. """
+    if width_sample is not None and width_sample < 1:
+        raise ValueError("width_sample must be positive")
+    if overflow is not None and overflow not in OVERFLOW_POLICIES:
+        raise ValueError("overflow must be one of: {0}".format(
+            ", ".join(OVERFLOW_POLICIES)))
+    if column_widths is not None and (not column_widths or
+                                      min(column_widths) < 0):
+        raise ValueError("column_widths must be non-negative integers")
+
+
+def iter_csv_ascii_table(csv_content,
+                         csv_delimiter=',',
+                         output_style='orgmode',
+                         column_align=None,
+                         no_header=False,
+                         align_in_tty=False,
+                         width_sample=None,
+                         overflow=None,
+                         column_widths=None,
+                         stats=None):
+    """ Convert csv to ascii table, generate lines of output table one by one.
+
+    The width of each column is computed before the first line is generated,
+    then each border and content line is generated lazily. Arguments are same
+    as csv_2_ascii_table.
+
+    Returns:
+      Generator of lines, each line is ended with a newline
+    """
+    assert output_style in RENDERERS
+    check_csv_layout(width_sample, overflow, column_widths)
+    args = (csv_delimiter, output_style, column_align, no_header, align_in_tty,
+            width_sample, overflow, column_widths)
+    if stats is not None:
+        return _iter_profiled(_iter_csv_ascii_table, csv_content, args, stats)
+    return _iter_csv_ascii_table(csv_content, *(args + (None, )))
+
+
+def _iter_csv_ascii_table(csv_content, csv_delimiter, output_style,
+                          column_align, no_header, align_in_tty, width_sample,
+                          overflow, column_widths, stats):
+    """ Generator of iter_csv_ascii_table, statistics are collected into stats
+    if it's not None. """
+    if stats is not None:
+        stats.enter('parse')
+    columns = gen_array_columns(csv_content)
+    if stats is not None:
+        stats.leave()
+    if columns is not None:
+        if column_widths is not None or width_sample is not None:
+            # Rows are output one by one by the path below
+            csv_content = list(zip(*[column.tolist() for column in columns]))
+        else:
+            if stats is not None:
+                stats.tables += 1
+                stats.cells += sum(len(column) for column in columns)
+            lines = iter_array_table_lines(columns, output_style,
+                                           column_align, no_header,
+                                           align_in_tty)
+            if stats is not None:
+                lines = _timed_iter(lines, stats, 'render')
+            for line in lines:
+                yield line
+            return
+    if column_widths is not None or width_sample is not None:
+        rows = iter_csv_rows(csv_content, csv_delimiter)
+        if stats is not None:
+            stats.tables += 1
+            rows = _timed_iter(_count_row_cells(rows, stats), stats, 'parse')
+        if column_widths is not None:
+            # Each row is output as soon as it is read
+            cols_width = list(column_widths)
+            if overflow is None:
+                overflow = 'truncate'
+        else:
+            # Only first width_sample rows are held for computing width, other
+            # rows are output as soon as they are read
+            sample = list(itertools.islice(rows, width_sample))
+            if stats is not None:
+                stats.enter('width')
+            cols_width = gen_plain_cols_width(sample, output_style,
+                                              align_in_tty)
+            if stats is not None:
+                stats.leave()
+            rows = itertools.chain(sample, rows)
+        if overflow is None:
+            overflow = 'stretch'
+        lines = iter_plain_table_lines(rows, cols_width, output_style,
+                                       column_align, no_header, align_in_tty,
+                                       overflow)
+        if stats is not None:
+            lines = _timed_iter(lines, stats, 'render')
+        for line in lines:
+            yield line
+        return
+    if stats is not None:
+        stats.enter('parse')
+    # Input is read in a single pass, each row is held as a tuple of strings,
+    # csv has no span so no MyTableCell is needed. Short rows are padded with
+    # empty cells when they are output.
+    rows = list(iter_csv_rows(csv_content, csv_delimiter))
+    if stats is not None:
+        stats.leave()
+        stats.tables += 1
+        stats.cells += sum(len(row) for row in rows)
+        stats.enter('width')
+    # Width of each cell is kept in a flat array, so it's not computed again
+    # when the cell is output
+    cells_width = array.array('i')
+    cols_width = gen_plain_cols_width(rows, output_style, align_in_tty,
+                                      cells_width)
+    if stats is not None:
+        stats.leave()
+    lines = iter_plain_table_lines(rows, cols_width, output_style,
+                                   column_align, no_header, align_in_tty,
+                                   'stretch', cells_width)
+    if stats is not None:
+        lines = _timed_iter(lines, stats, 'render')
+    for line in lines:
+        yield line
+
+
 def csv_2_ascii_table(csv_content,
                       csv_delimiter=',',
                       output_style='orgmode',
                       column_align=None,
                       no_header=False,
-                      align_in_tty=False):
+                      align_in_tty=False,
+                      width_sample=None,
+                      overflow=None,
+                      column_widths=None,
+                      stats=None):
     """ Convert csv to ascii table.
 
     Arguments:
-      csv_content: Data of input csv, can be string or 'list of list'.
+      csv_content: Data of input csv, can be string, file object, 'list of
+                   list', pandas DataFrame or 2-D numpy array. File object
+                   is read line by line. 'list of list' can be any
+                   iterable of rows, e.g. generator, csv.reader or database
+                   cursor, it's read in a single pass. Header of DataFrame
+                   is its column names (index is not output). Values which
+                   are not strings are converted by str(). Width of
+                   DataFrame and array columns is computed with numpy,
+                   column by column.
       csv_delimiter: The delimiter of csv string data (default is ',').
-      output_style: The output style: emacs|orgmode|mysql|markdown
-                    (default is 'orgmode').
+      output_style: The output style: emacs|orgmode|mysql|markdown, or a
+                    style added by register_renderer (default is
+                    'orgmode').
       column_align: align string of columns, support 'l/r'. For example, 
                    'llrr' specify first two colums align left, 3rd and 4th
                    columns align right. Default alignment is left.
       no_header: whether print horizontal header line. Default is False
       align_in_tty: force align column in tty
+      width_sample: compute width of columns from first width_sample rows
+                    only, rather than all rows, it must be positive. Default
+                    is None (all rows).
+      overflow: how to output cell wider than its column when width_sample
+                or column_widths is given: 'truncate' cuts it and appends a
+                '~' marker, 'stretch' lets the cell stretch past the border.
+                Default is 'truncate' for column_widths, otherwise 'stretch'.
+      column_widths: list of non-negative width of each column, for example
+                     [10, 8, 24]. If it's given, width of columns is not
+                     computed and each row is output as soon as it's read,
+                     width_sample is ignored. Default is None.
+      stats: ConversionStats which collects time of each stage, number of
+             cells and width() calls, size of input and output, and peak
+             memory of the conversion. It can also be a callable, which is
+             called with a new ConversionStats after conversion. Default is
+             None, nothing is collected.
 
     Returns:
       Ascii table
+
+    Raises:
+      ValueError: width_sample, overflow or column_widths is not valid.
     """
-    assert output_style in ['emacs', 'orgmode', 'mysql', 'markdown']
-    if _is_string(csv_content):
-        table = gen_table_from_csv(csv_content, csv_delimiter)
-    elif isinstance(csv_content, list):
-        table = gen_table_from_list(csv_content)
-    else:
-        raise Exception("Unsupported csv_content type")
-    cols_max_width = gen_output_cols_width(table, output_style, align_in_tty)
-    logger.debug("cols_max_width=%s", cols_max_width)
-    output_str = ''
-    if output_style == 'emacs':
-        output_str += output_emacs_table(table, cols_max_width, column_align,
-                                         align_in_tty)
-    else:
-        output_str += output_other_table(table, cols_max_width, output_style,
-                                         column_align, no_header, align_in_tty)
+    output_str = "".join(
+        iter_csv_ascii_table(csv_content, csv_delimiter, output_style,
+                             column_align, no_header, align_in_tty,
+                             width_sample, overflow, column_widths, stats))
     # logger.debug("Out put is:\n" + output_str)
     return output_str
 
 
+def iter_html_tables(html_content):
+    """ Parse tables in html_content, generate each table as soon as its
+    closing tag is handled, the table is released by parser then.
+
+    html_content can be a string, a file object, or an iterable of string
+    chunks. File object is read block by block and each block (or chunk) is
+    fed into parser one by one, so the whole html is never held in memory.
+    """
+    if _is_string(html_content):
+        chunks = [html_content]
+    elif hasattr(html_content, 'read'):
+        chunks = iter_input_blocks(html_content)
+    else:
+        chunks = html_content
+    parser = get_html_parser_class()()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.tables:
+            tables = parser.tables
+            parser.tables = []
+            for table in tables:
+                yield table
+    parser.close()
+    for table in parser.tables:
+        yield table
+
+
+def iter_html_table_lines(table,
+                          output_style,
+                          column_align,
+                          no_header,
+                          align_in_tty,
+                          stats=None):
+    """ Expand spans of a table parsed by MyHTMLParser, then generate lines of
+    its output table one by one. Time of each stage is added to stats if it's
+    not None. """
+    if stats is not None:
+        stats.enter('expand')
+    table_expand_spans = gen_expand_table(table)
+    logger.debug("cell types of table_expand_spans:\n%s",
+                 CellTypesDump(table_expand_spans))
+    if stats is not None:
+        stats.leave()
+        stats.enter('width')
+    metrics = gen_cell_metrics(table_expand_spans, output_style, align_in_tty)
+    cols_max_width = gen_output_cols_width(table_expand_spans, output_style,
+                                           align_in_tty, metrics)
+    if stats is not None:
+        stats.leave()
+    logger.debug("cols_max_width=%s", cols_max_width)
+    lines = RENDERERS[output_style].iter_table_lines(table_expand_spans,
+                                                     cols_max_width,
+                                                     column_align, no_header,
+                                                     align_in_tty, metrics)
+    if stats is not None:
+        lines = _timed_iter(lines, stats, 'render')
+    for line in lines:
+        # With Python 3.6, &nbsp; &#160; would convert to NO-BREAK SPACE(0xA0)
+        # by HTMLParser. I expect it just convert to SPACE(0x20).
+        if sys.version_info[0] >= 3:
+            line = line.replace(chr(0xA0), chr(0x20))
+        yield line
+
+
+# Tables are rendered in a process pool only if they have at least this number
+# of cells in total, otherwise starting the pool costs more than it saves.
+PARALLEL_MIN_CELLS = 20000
+
+
+# Number of tables sent to each worker of the pool ahead of output, tables
+# are parsed only when they are sent, so input is not parsed far ahead of
+# output.
+POOL_TABLES_PER_WORKER = 2
+
+
+def _render_html_table_task(task):
+    """ Render one html table in a worker process of pool, return (lines of
+    output table, width() calls, width() calls missed in WIDTH_CACHE). width()
+    calls are counted only if count_width of task is True. """
+    table, output_style, column_align, no_header, width1_chars, \
+        count_width = task
+    stats = ConversionStats(trace_memory=False) if count_width else None
+    # A worker process renders one table at a time, the conversion state is
+    # set for each of them
+    _ACTIVE_CONVERSION.width1_chars = width1_chars
+    _ACTIVE_CONVERSION.stats = stats
+    _PROFILED_CONVERSIONS[0] = 1 if count_width else 0
+    lines = list(
+        iter_html_table_lines(table, output_style, column_align, no_header,
+                              False))
+    if stats is None:
+        return lines, 0, 0
+    return lines, stats.width_calls, stats.width_computed
+
+
+def _iter_tables_lines_in_pool(tables, workers, output_style, column_align,
+                               no_header, stats):
+    """ Render tables in a pool of workers processes, generate list of lines
+    of each output table, in the order of tables. Tables are pulled in current
+    thread, at most POOL_TABLES_PER_WORKER tables per worker are sent ahead
+    of the generated one. width() calls in workers are added to stats if it's
+    not None. """
+    import multiprocessing
+    tables = iter(tables)
+    pool = multiprocessing.Pool(workers)
+    try:
+        width1_chars = list(get_width1_chars())
+
+        def submit(table):
+            task = (table, output_style, column_align, no_header,
+                    width1_chars, stats is not None)
+            return pool.apply_async(_render_html_table_task, (task, ))
+
+        pending = [submit(table) for table in
+                   itertools.islice(tables, workers * POOL_TABLES_PER_WORKER)]
+        while pending:
+            lines, width_calls, width_computed = pending.pop(0).get()
+            # Keep workers busy while lines of this table are consumed
+            for table in itertools.islice(tables, 1):
+                pending.append(submit(table))
+            if stats is not None:
+                stats.width_calls += width_calls
+                stats.width_computed += width_computed
+            yield lines
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_html_ascii_tables(html_content,
+                           output_style='orgmode',
+                           column_align=None,
+                           no_header=False,
+                           align_in_tty=False,
+                           workers=None,
+                           stats=None):
+    """ Convert html tables to ascii tables, generate lines of output tables
+    one by one. An empty line is generated between two tables.
+
+    The width of each column is computed before the first line of its table
+    is generated, then each border and content line is generated lazily.
+    Arguments are same as html_2_ascii_table.
+
+    Returns:
+      Generator of lines, each line is ended with a newline
+    """
+    assert output_style in RENDERERS
+    args = (output_style, column_align, no_header, align_in_tty, workers)
+    if stats is not None:
+        return _iter_profiled(_iter_html_ascii_tables, html_content, args,
+                              stats)
+    return _iter_html_ascii_tables(html_content, *(args + (None, )))
+
+
+def _iter_html_ascii_tables(html_content, output_style, column_align,
+                            no_header, align_in_tty, workers, stats):
+    """ Generator of iter_html_ascii_tables, statistics are collected into
+    stats if it's not None. """
+    tables = iter_html_tables(html_content)
+    if stats is not None:
+        tables = _count_cells(_timed_iter(tables, stats, 'parse'), stats)
+    tables_lines = None
+    # Terminal can't be shared by worker processes, so align_in_tty is always
+    # processed in current process
+    if workers is not None and workers > 1 and not align_in_tty:
+        # Hold tables until they are big enough to be worth starting a pool
+        held_tables = []
+        num_cells = 0
+        for table in tables:
+            held_tables.append(table)
+            num_cells += sum(len(row) for row in table)
+            if num_cells >= PARALLEL_MIN_CELLS:
+                tables_lines = _iter_tables_lines_in_pool(
+                    itertools.chain(held_tables, tables), workers,
+                    output_style, column_align, no_header, stats)
+                if stats is not None:
+                    # Tables are expanded and measured in workers too
+                    tables_lines = _timed_iter(tables_lines, stats, 'render')
+                break
+        else:
+            tables = held_tables
+    if tables_lines is None:
+        tables_lines = (iter_html_table_lines(table, output_style,
+                                              column_align, no_header,
+                                              align_in_tty, stats)
+                        for table in tables)
+    for index, lines in enumerate(tables_lines):
+        if index > 0:
+            yield "\n"  # output newline as the delimiter of multiple tables
+        for line in lines:
+            yield line
+
+
 def html_2_ascii_table(html_content,
                        output_style='orgmode',
                        column_align=None,
                        no_header=False,
-                       align_in_tty=False):
+                       align_in_tty=False,
+                       workers=None,
+                       stats=None):
     """ Convert html table to ascii table.
 
     Arguments:
-      html_content: Data of input html.
-      output_style: The output style: emacs|orgmode|mysql|markdown
-                    (default is 'orgmode').
+      html_content: Data of input html, can be string, file object or iterable
+                    of string chunks.
+      output_style: The output style: emacs|orgmode|mysql|markdown, or a
+                    style added by register_renderer (default is
+                    'orgmode').
       column_align: align string of columns, support 'l/r'. For example, 
                    'llrr' specify first two colums align left, 3rd and 4th
                    columns align right. Default alignment is left.
       no_header: whether print horizontal header line. Default is False
       align_in_tty: force align column in tty
+      workers: number of worker processes that render tables in parallel.
+               Tables are rendered in current process if it's None or 1, or
+               the input is small. Default is None.
+      stats: ConversionStats which collects statistics of the conversion, see
+             csv_2_ascii_table. Default is None, nothing is collected.
 
     Returns:
       Ascii table
     """
-    assert output_style in ['emacs', 'orgmode', 'mysql', 'markdown']
-    output_str = ''
-    parser = MyHTMLParser()
-    parser.feed(html_content)
-    for table in parser.tables:
-        table_expand_spans = gen_expand_table(table)
-        logger.debug("cell types of table_expand_spans:\n" +
-                     dump_cell_types(table_expand_spans))
-        cols_max_width = gen_output_cols_width(table_expand_spans,
-                                               output_style, align_in_tty)
-        logger.debug("cols_max_width=%s", cols_max_width)
-        if output_style == 'emacs':
-            output_str += output_emacs_table(
-                table_expand_spans, cols_max_width, column_align, align_in_tty)
-        else:
-            output_str += output_other_table(
-                table_expand_spans, cols_max_width, output_style, column_align,
-                no_header, align_in_tty)
-        output_str += "\n"  # output newline as the delimiter of multiple tables
-    # With Python 3.6, &nbsp; &#160; would convert to NO-BREAK SPACE(0xA0) by
-    # HTMLParser. I expect it just convert to SPACE(0x20).
-    output_str = output_str if sys.version_info[0] < 3 \
-                            else output_str.replace(chr(0xA0), chr(0x20))
+    output_str = "".join(
+        iter_html_ascii_tables(html_content, output_style, column_align,
+                               no_header, align_in_tty, workers, stats))
     # logger.debug("Out put is:\n" + output_str)
-    return output_str[:-1] if output_str.endswith("\n") else output_str
+    return output_str
+
+
+def _is_binary_stream(stream):
+    """ Return true if stream accepts bytes rather than text """
+    if isinstance(stream, io.TextIOBase):
+        return False
+    if isinstance(stream, (io.BufferedIOBase, io.RawIOBase)):
+        return True
+    if sys.version_info[0] < 3:  # builtin file object of python 2
+        return isinstance(stream, file)
+    return 'b' in getattr(stream, 'mode', '')
+
+
+def render_to(stream, lines, encoding='utf-8', flush=False):
+    """ Write lines into stream one by one.
+
+    Arguments:
+      stream: A text stream, or a binary stream such as sys.stdout.buffer or
+              file opened in 'wb' mode. Lines are encoded one by one with
+              encoding if stream is binary.
+      lines: Lines generated by iter_csv_ascii_table or
+             iter_html_ascii_tables.
+      encoding: Encoding of output in binary stream (default is 'utf-8').
+      flush: Flush stream after each line, so that reader of stream gets each
+             line as soon as it's generated (default is False).
+
+    Returns:
+      Number of lines written
+    """
+    write = stream.write
+    num_lines = 0
+    binary = _is_binary_stream(stream)
+    for line in lines:
+        write(line.encode(encoding) if binary else line)
+        if flush:
+            stream.flush()
+        num_lines += 1
+    return num_lines
+
+
+# Size of each block read from input
+INPUT_BLOCK_SIZE = 64 * 1024
+
+
+def read_input_head(input_file):
+    """ Read from input_file until its first non-empty line is complete, or
+    end of file is reached. Return data read. It's read line by line, so it
+    does not wait for more data of a pipe than the first line. """
+    head = ''
+    while True:
+        line = input_file.readline()
+        head += line
+        if not line or line.strip(" \r\n"):
+            return head
+
+
+class HeadedInput(object):
+    """ File-like object which reads head (data already read from input_file)
+    first, then the rest of input_file. It supports read(), readline() and
+    iterating lines. """
+
+    def __init__(self, head, input_file):
+        self._head = head
+        self._input_file = input_file
+
+    def read(self, size=-1):
+        if self._head:
+            head = self._head
+            self._head = ''
+            if size is None or size < 0:
+                return head + self._input_file.read()
+            return head
+        return self._input_file.read(size)
+
+    def readline(self, size=-1):
+        """ Return head if it's not read yet, it may contain multiple lines,
+        otherwise a line of input_file. """
+        if self._head:
+            head = self._head
+            self._head = ''
+            return head
+        return self._input_file.readline(size)
+
+    def seekable(self):
+        return is_seekable(self._input_file)
+
+    def __iter__(self):
+        head = self._head
+        self._head = ''
+        partial_line = ''
+        for line in iter_lines(head):
+            if line.endswith('\n'):
+                yield line
+            else:  # the last line in head may be incomplete
+                partial_line = line
+        rest = iter_file_lines(self._input_file)
+        if partial_line:
+            yield partial_line + next(rest, '')
+        for line in rest:
+            yield line
+
+
+def is_seekable(input_file):
+    """ Return True if input_file is seekable, i.e. it's not a pipe or a
+    terminal, whose read() waits until the requested size of data arrives. """
+    seekable = getattr(input_file, 'seekable', None)
+    if seekable is not None:
+        return seekable()
+    try:  # builtin file of python 2
+        input_file.tell()
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def iter_input_blocks(input_file):
+    """ Generate blocks read from input_file until end of file. If input_file
+    is not seekable, e.g. a pipe, a block is at most a line, so that it's
+    generated as soon as the line arrives rather than waiting for a whole
+    block. """
+    read = input_file.read
+    if hasattr(input_file, 'readline') and not is_seekable(input_file):
+        read = input_file.readline
+    while True:
+        block = read(INPUT_BLOCK_SIZE)
+        if not block:
+            return
+        yield block
+
+
+# Options of conversion and their default values, they are named as dest of
+# command line options
+DEFAULT_OPTIONS = {
+    'input_format': None,
+    'output_style': 'orgmode',
+    'csv_delimiter': None,
+    'no_header': False,
+    'column_align': None,
+    'width1_chars': None,
+    'align_in_tty': False,
+    'jobs': None,
+    'width_sample': None,
+    'overflow': None,
+    'column_widths': None,
+    'profile': False,
+}
+
+
+def gen_arg_parser():
+    """ Return parser of command line arguments """
+    import argparse  # argparse is introduced in Python 2.7 and Python 3.2
+    arg_parser = argparse.ArgumentParser(
+        description='Yet Another Table Generator, ' \
+        'convert CSV or html table to ASCII art table.')
+    arg_parser.add_argument(
+        "-i",
+        "--input-file",
+        action='append',
+        help="source file, read from stdin if not specified. It can be " \
+             "given multiple times, and it can be a directory or a glob " \
+             "pattern, see --output-dir and --output-suffix.",
+        metavar='INFILE',
+        dest="input_files")
+    arg_parser.add_argument(
+        "-f",
+        "--input-format",
+        help="format of input file, can be 'html' or 'csv', " \
+             "auto guess it if not specified",
+        dest="input_format",
+        metavar='FORMAT',
+        choices=["html", "csv"])
+    arg_parser.add_argument(
+        "-d",
+        "--csv-delimiter",
+        help="delimiter of csv data, guess it if not specified",
+        metavar='DELIMITER',
+        dest="csv_delimiter")
+    arg_parser.add_argument(
+        "-o",
+        "--output-file",
+        help="output file, write to stdout if not specified",
+        metavar='OUTFILE',
+        dest="output_file")
+    arg_parser.add_argument(
+        "--output-dir",
+        help="convert each input file to a file in directory DIR, its " \
+             "name is name of input file with extension replaced by " \
+             "--output-suffix. It's required by multiple input files " \
+             "if --output-suffix is not specified.",
+        metavar='DIR',
+        dest="output_dir")
+    arg_parser.add_argument(
+        "--output-suffix",
+        help="convert each input file to a file beside it (or in " \
+             "--output-dir), its name is name of input file with " \
+             "extension replaced by SUFFIX. '{style}' in SUFFIX is " \
+             "replaced by output style. Default is '.txt'.",
+        metavar='SUFFIX',
+        dest="output_suffix")
+    arg_parser.add_argument(
+        "-s",
+        "--output-style",
+        help="specify output table style, support 'orgmode', 'emacs', " \
+             "'mysql', 'markdown', default is orgmode style",
+        metavar='STYLE',
+        default="orgmode",
+        dest="output_style",
+        choices=list(RENDERERS))
+    arg_parser.add_argument(
+        '--no-header',
+        help=
+        "horizontal header line would not be printed if this option present",
+        action='store_true',
+        dest="no_header")
+    arg_parser.add_argument(
+        "--column-align",
+        help="specify align string of columns, support 'l/r'. For " \
+             "example, 'llrr' specify first two colums align left, 3rd " \
+             "and 4th columns align right. Default alignment is left.",
+        metavar='ALIGN',
+        dest="column_align")
+    arg_parser.add_argument(
+        "--width1-chars",
+        help="specify chars that should consider one character width by " \
+             "force, only 'emoji' is supported currently. Emoji " \
+             "sequence (ZWJ sequence, emoji with skin tone, flag) is " \
+             "one character width as a whole. This option requires " \
+             "package emoji.",
+        metavar='CHARS',
+        dest="width1_chars",
+        choices=["emoji"])
+    arg_parser.add_argument(
+        "--align-in-tty",
+        help="set column aligned in tty. This option requires package " \
+             "blessed. If this option present, option --width1-chars " \
+             "would be ignored. NOTE: (1) this option requires you in a " \
+             "tty, (2) each column width must less than width of tty, " \
+             "please enlarge your tty window if you have long cell data.",
+        action='store_true',
+        dest="align_in_tty")
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of worker processes that render html tables in " \
+             "parallel, or convert input files in parallel if there are " \
+             "multiple input files, default is 1.",
+        type=int,
+        metavar='N',
+        dest="jobs")
+    arg_parser.add_argument(
+        "--width-sample",
+        help="compute width of columns from first N rows of csv only, " \
+             "then each row is output as soon as it's read. Cells wider " \
+             "than its column are handled by --overflow.",
+        type=int,
+        metavar='N',
+        dest="width_sample")
+    arg_parser.add_argument(
+        "--overflow",
+        help="how to output cell wider than its column, 'truncate' or " \
+             "'stretch'. 'truncate' cuts the cell and appends a '~' " \
+             "marker, 'stretch' lets the cell stretch past the border. " \
+             "Default is 'truncate' for --column-widths, otherwise " \
+             "'stretch'.",
+        metavar='POLICY',
+        dest="overflow",
+        choices=OVERFLOW_POLICIES)
+    arg_parser.add_argument(
+        "--column-widths",
+        help="specify width of each column of csv, for example " \
+             "'10,8,24'. Width of columns is not computed and each row " \
+             "is output as soon as it's read, cells wider than its " \
+             "column are handled by --overflow.",
+        metavar='WIDTHS',
+        dest="column_widths")
+    arg_parser.add_argument(
+        "--profile",
+        help="print time of each stage, number of cells and width() " \
+             "calls, size of input and output, and peak traced memory " \
+             "to stderr after conversion. Tracing memory slows " \
+             "conversion down.",
+        action='store_true',
+        dest="profile")
+    arg_parser.add_argument(
+        "--serve",
+        help="run as a daemon which serves conversions on unix socket " \
+             "SOCKET, see --client.",
+        metavar='SOCKET',
+        dest="serve")
+    arg_parser.add_argument(
+        "--client",
+        help="send input to the daemon serving on unix socket SOCKET, it " \
+             "converts input with other options and sends the table back. " \
+             "It saves interpreter startup and module import of each " \
+             "conversion.",
+        metavar='SOCKET',
+        dest="client")
+    arg_parser.add_argument(
+        "--version",
+        help="show version and exit.",
+        action='store_true',
+        dest="show_version")
+    return arg_parser
+
+
+def options_from_args(args):
+    """ Return options of conversion (see DEFAULT_OPTIONS) in parsed command
+    line arguments args """
+    return dict((name, getattr(args, name)) for name in DEFAULT_OPTIONS)
+
+
+def is_batch_input(input_paths):
+    """ Return True if input_paths (paths given by -i) are more than one
+    file, or a directory, or a glob pattern. """
+    if len(input_paths) != 1:
+        return True
+    path = input_paths[0]
+    return os.path.isdir(path) or (not os.path.exists(path) and
+                                   any(c in path for c in GLOB_CHARS))
 
 
 def main_entry(argv):
+    options = dict(DEFAULT_OPTIONS)
     input_file = None
-    input_format = None
     output_file = None
-    output_style = 'orgmode'  # default
-    csv_delimiter = None
-    no_header = False
-    column_align = None
-    width1_chars = None
-    align_in_tty = False
-    show_version = False
+    serve_socket = None
+    input_paths = None
+    output_dir = None
+    output_suffix = None
     try:
-        import argparse  # argparse is introduced in Python 2.7 and Python 3.2
-        arg_parser = argparse.ArgumentParser(
-            description='Yet Another Table Generator, ' \
-            'convert CSV or html table to ASCII art table.')
-        arg_parser.add_argument(
-            "-i",
-            "--input-file",
-            type=argparse.FileType('r'),
-            help="source file, read from stdin if not specified",
-            metavar='INFILE',
-            dest="input_file")
-        arg_parser.add_argument(
-            "-f",
-            "--input-format",
-            help="format of input file, can be 'html' or 'csv', " \
-                 "auto guess it if not specified",
-            dest="input_format",
-            metavar='FORMAT',
-            choices=["html", "csv"])
-        arg_parser.add_argument(
-            "-d",
-            "--csv-delimiter",
-            help="delimiter of csv data, guess it if not specified",
-            metavar='DELIMITER',
-            dest="csv_delimiter")
-        arg_parser.add_argument(
-            "-o",
-            "--output-file",
-            help="output file, write to stdout if not specified",
-            metavar='OUTFILE',
-            dest="output_file")
-        arg_parser.add_argument(
-            "-s",
-            "--output-style",
-            help="specify output table style, support 'orgmode', 'emacs', " \
-                 "'mysql', 'markdown', default is orgmode style",
-            metavar='STYLE',
-            default="orgmode",
-            dest="output_style",
-            choices=["emacs", "orgmode", "mysql", "markdown"])
-        arg_parser.add_argument(
-            '--no-header',
-            help=
-            "horizontal header line would not be printed if this option present",
-            action='store_true',
-            dest="no_header")
-        arg_parser.add_argument(
-            "--column-align",
-            help="specify align string of columns, support 'l/r'. For " \
-                 "example, 'llrr' specify first two colums align left, 3rd " \
-                 "and 4th columns align right. Default alignment is left.",
-            metavar='ALIGN',
-            dest="column_align")
-        arg_parser.add_argument(
-            "--width1-chars",
-            help="specify chars that should consider one character width by " \
-                 "force, only 'emoji' is supported currently. This option " \
-                 "requires package emoji.",
-            metavar='CHARS',
-            dest="width1_chars",
-            choices=["emoji"])
-        arg_parser.add_argument(
-            "--align-in-tty",
-            help="set column aligned in tty. This option requires package " \
-                 "blessed. If this option present, option --width1-chars " \
-                 "would be ignored. NOTE: (1) this option requires you in a " \
-                 "tty, (2) each column width must less than width of tty, " \
-                 "please enlarge your tty window if you have long cell data.",
-            action='store_true',
-            dest="align_in_tty")
-        arg_parser.add_argument(
-            "--version",
-            help="show version and exit.",
-            action='store_true',
-            dest="show_version")
+        arg_parser = gen_arg_parser()
         args = arg_parser.parse_args(argv[1:])
-        input_file = args.input_file
-        input_format = args.input_format
-        output_file = args.output_file
-        output_style = args.output_style
-        csv_delimiter = args.csv_delimiter
-        no_header = args.no_header
-        column_align = args.column_align
-        width1_chars = args.width1_chars
-        align_in_tty = args.align_in_tty
-        show_version = args.show_version
-
     except ImportError:
         sys.stderr.write("Warn: Cannot import argparse. Read from stdin, " \
-                         "convert to {0} style always\n".format(output_style))
-    if show_version:
-        sys.stderr.write(__version__)
-        sys.exit(0)
-    if column_align is not None:
-        if column_align.replace("l", "").replace("r", ""):
-            sys.stderr.write(
-                "--column-align is not valid, only l/r is supported.\n")
+                         "convert to {0} style always\n".format(
+                             options['output_style']))
+    else:
+        if args.show_version:
+            sys.stderr.write(__version__)
+            sys.exit(0)
+        if args.client is not None:
+            sys.exit(run_client(argv))
+        options = options_from_args(args)
+        output_file = args.output_file
+        serve_socket = args.serve
+        output_dir = args.output_dir
+        output_suffix = args.output_suffix
+        if args.input_files:
+            if output_dir is not None or output_suffix is not None or \
+                    is_batch_input(args.input_files):
+                input_paths = args.input_files
+            else:
+                try:
+                    input_file = argparse_open(args.input_files[0])
+                except Exception as e:
+                    arg_parser.error("argument -i/--input-file: {0}".format(e))
+    if serve_socket is not None:
+        exit_code = serve(serve_socket)
+    elif input_paths is not None or output_dir is not None or \
+            output_suffix is not None:
+        if output_file is not None:
+            sys.stderr.write("Error: -o/--output-file can not be used with " \
+                             "multiple input files.\n")
             sys.exit(1)
-    if width1_chars == 'emoji':
-        if not EMOJI_AVAILABLE:
-            sys.stderr.write("Error: force emoji be one character width require" \
-                             " package emoji, please run `pip install emoji`.\n")
+        if output_dir is None and output_suffix is None:
+            sys.stderr.write("Error: multiple input files require " \
+                             "--output-dir or --output-suffix.\n")
             sys.exit(1)
-        FORCE_WIDTH1_CHARS.append('emoji')
-    if align_in_tty:
-        if not BLESSED_AVAILABLE:
-            sys.stderr.write("Error: option --align-in-tty require package " \
-                             "blessed, please run `pip install blessed`\n")
+        if input_paths is None:
+            sys.stderr.write("Error: --output-dir and --output-suffix " \
+                             "require -i/--input-file.\n")
             sys.exit(1)
-    if input_file:  # read from file
-        input_content = input_file.read()
-        input_file.close()
-    else:  # read from stdin
-        sys.stderr.write(
-            "Info: read data from stdin, press Ctrl-D (i.e. EOF) when finished\n"
-        )
-        input_content = sys.stdin.read()
-    if input_format is None:
-        # Guess input_format is html if it starts with <
-        if input_content.strip(" \r\n\t").startswith("<"):
-            input_format = "html"
-        else:
-            input_format = "csv"
-        logger.debug("Guess input_format as [%s]", input_format)
-    if input_format == "csv" and csv_delimiter is None:
-        # Guess csv_delimiter
-        firstline = input_content.strip(" \r\n").split('\n', 1)[0]
-        candidate = [",", "\t", ";", "|"]
-        occurs = [firstline.count(c) for c in candidate]
-        best_index = occurs.index(max(occurs))  # index of max item
-        csv_delimiter = candidate[best_index]
-        if firstline:  # not empty
-            sys.stderr.write(
-                "Info: auto set character [{0}] as csv_delimiter.\n".format(
-                    csv_delimiter))
-    out_content = ""
-    if input_format == "html":
-        out_content = html_2_ascii_table(input_content, output_style,
-                                         column_align, no_header, align_in_tty)
-    elif input_format == "csv":
-        out_content = csv_2_ascii_table(input_content, csv_delimiter,
-                                        output_style, column_align, no_header,
-                                        align_in_tty)
-    if out_content:
-        if output_file is None:
-            sys.stdout.write(out_content)
+        exit_code = convert_batch(options, input_paths, output_dir,
+                                  output_suffix)
+    else:
+        exit_code = convert_cli(options, input_file, output_file)
+    if exit_code:
+        sys.exit(exit_code)
+
+
+def argparse_open(path):
+    """ Open input file path as argparse.FileType('r') does, '-' is stdin """
+    import argparse
+    return argparse.FileType('r')(path)
+
+
+def parse_cli_options(options):
+    """ Check options of command line tool (see DEFAULT_OPTIONS) which do not
+    depend on input, return a copy of options in which column_widths is
+    parsed as list of integers. Raise ValueError with the message to report
+    if any option is not valid. """
+    options = dict(options)
+    column_align = options['column_align']
+    column_widths = options['column_widths']
+    jobs = options['jobs']
+    if column_align is not None:
+        if column_align.replace("l", "").replace("r", ""):
+            raise ValueError(
+                "--column-align is not valid, only l/r is supported.")
+    if column_widths is not None:
+        try:
+            column_widths = [int(x) for x in column_widths.split(',')]
+        except ValueError:
+            raise ValueError("--column-widths is not valid, it must be " \
+                             "comma separated non-negative integers.")
+        options['column_widths'] = column_widths
+    try:
+        check_csv_layout(options['width_sample'], options['overflow'],
+                         column_widths)
+    except ValueError as e:
+        raise ValueError("Error: {0}.".format(e))
+    if jobs is not None and jobs < 1:
+        raise ValueError("--jobs is not valid, it must be positive.")
+    if options['width1_chars'] == 'emoji' and \
+            import_optional('emoji') is None:
+        raise ValueError("Error: force emoji be one character width require" \
+                         " package emoji, please run `pip install emoji`.")
+    if options['align_in_tty'] and import_optional('blessed') is None:
+        raise ValueError("Error: option --align-in-tty require package " \
+                         "blessed, please run `pip install blessed`")
+    return options
+
+
+def convert_cli(options, input_file, output_file, stdout=None, stderr=None):
+    """ Convert input_file with options (see DEFAULT_OPTIONS) as command line
+    tool does. Table is written to output_file, or binary stream stdout if
+    output_file is None. Messages are written to stderr. input_file is stdin
+    if it's None, it's closed when it returns unless it's stdin. Return exit
+    code, it's 1 if any option is not valid.
+
+    stdout is the binary buffer of sys.stdout, and stderr is sys.stderr by
+    default.
+    """
+    if stderr is None:
+        stderr = sys.stderr
+    try:
+        try:
+            options = parse_cli_options(options)
+        except ValueError as e:
+            stderr.write("{0}\n".format(e))
+            return 1
+        input_format = options['input_format']
+        output_style = options['output_style']
+        csv_delimiter = options['csv_delimiter']
+        no_header = options['no_header']
+        column_align = options['column_align']
+        width1_chars = options['width1_chars']
+        align_in_tty = options['align_in_tty']
+        jobs = options['jobs']
+        width_sample = options['width_sample']
+        overflow = options['overflow']
+        column_widths = options['column_widths']
+        profile = options['profile']
+        if input_file is None:  # read from stdin
+            stderr.write("Info: read data from stdin, press Ctrl-D (i.e. " \
+                         "EOF) when finished\n")
+            input_file = sys.stdin
+        # Only head of input is read for guessing, nothing is read if format
+        # and delimiter are given
+        input_head = ''
+        if input_format is None or (input_format == "csv" and
+                                    csv_delimiter is None):
+            input_head = read_input_head(input_file)
+        if input_format is None:
+            # Guess input_format is html if it starts with <
+            if input_head.strip(" \r\n\t").startswith("<"):
+                input_format = "html"
+            else:
+                input_format = "csv"
+            logger.debug("Guess input_format as [%s]", input_format)
+        if input_format == "html" and (width_sample is not None or
+                                       overflow is not None or
+                                       column_widths is not None):
+            stderr.write("Error: --width-sample, --overflow and " \
+                         "--column-widths are only supported for csv input.\n")
+            return 1
+        if input_format == "csv" and csv_delimiter is None:
+            # Guess csv_delimiter
+            firstline = input_head.strip(" \r\n").split('\n', 1)[0]
+            candidate = [",", "\t", ";", "|"]
+            occurs = [firstline.count(c) for c in candidate]
+            best_index = occurs.index(max(occurs))  # index of max item
+            csv_delimiter = candidate[best_index]
+            if firstline:  # not empty
+                stderr.write("Info: auto set character [{0}] as " \
+                             "csv_delimiter.\n".format(csv_delimiter))
+        # Input is never read as a whole, html is read block by block and csv
+        # is read line by line while it's converted
+        input_content = HeadedInput(input_head, input_file)
+        stats = ConversionStats() if profile else None
+        out_lines = []
+        if input_format == "html":
+            out_lines = iter_html_ascii_tables(input_content, output_style,
+                                               column_align, no_header,
+                                               align_in_tty, jobs, stats)
+        elif input_format == "csv":
+            out_lines = iter_csv_ascii_table(input_content, csv_delimiter,
+                                             output_style, column_align,
+                                             no_header, align_in_tty,
+                                             width_sample, overflow,
+                                             column_widths, stats)
+        # width1_chars belongs to this conversion, rather than
+        # FORCE_WIDTH1_CHARS, so that concurrent conversions of daemon do not
+        # affect each other
+        out_lines = _iter_with_width1_chars(
+            out_lines, ['emoji'] if width1_chars == 'emoji' else [])
+        # Each row of csv is output as soon as it's read in these modes, and
+        # each html table is output as soon as it's read from a pipe, flush
+        # them so that they are not held in buffer of output
+        if input_format == "csv":
+            flush = width_sample is not None or column_widths is not None
         else:
-            outfile = open(output_file, 'w')
-            # Convert content to utf-8 when python 2, avoid following error:
-            # UnicodeDecodeError: 'ascii' codec can't decode byte 0xe8 in position xx
-            if sys.version_info[0] < 3:
-                out_content = out_content.encode('utf-8')
-            outfile.write(out_content)
+            flush = not is_seekable(input_file)
+        write_output(out_lines, output_file, stdout, stderr, flush)
+        if stats is not None:
+            stderr.write(stats.report())
+        return 0
+    finally:
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+
+
+def write_output(out_lines,
+                 output_file,
+                 stdout=None,
+                 stderr=None,
+                 flush=False):
+    """ Write each line as soon as it is generated, output file is created when
+    the first line is available. Write to binary stream stdout if output_file
+    is None, it's the binary buffer of sys.stdout by default. Output is
+    flushed after each line if flush is True. """
+    out_lines = iter(out_lines)
+    first_line = next(out_lines, None)
+    if first_line is None:
+        (stderr or sys.stderr).write("Warn: No table is generated, may be " \
+                                     "your input data is empty or unnormal.\n")
+        return
+    if output_file is None:
+        # Write utf-8 bytes into the binary buffer under sys.stdout
+        outfile = stdout or getattr(sys.stdout, 'buffer', sys.stdout)
+    else:
+        outfile = open(output_file, 'wb')
+    try:
+        render_to(outfile, itertools.chain([first_line], out_lines),
+                  flush=flush)
+        outfile.flush()
+    except IOError as e:
+        # Stop quietly if reader of pipe is closed, for example `yatg | head`
+        if e.errno != errno.EPIPE or output_file is not None:
+            raise
+        # Redirect remaining output to devnull, so that flushing stdout at
+        # exit does not complain about the broken pipe again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    finally:
+        if output_file is not None:
             outfile.close()
+
+
+class MessageBuffer(object):
+    """ Stream which collects messages written to it, it's used as stderr of
+    a conversion of daemon and batch mode. """
+
+    def __init__(self):
+        self._messages = []
+
+    def write(self, message):
+        self._messages.append(message)
+
+    def getvalue(self):
+        return ''.join(self._messages)
+
+
+def convert_isolated(options, input_file, output_file, stdout=None):
+    """ Run convert_cli, but collect its messages instead of writing them to
+    stderr, so that conversions in a process do not mix their messages. An
+    exception of the conversion is reported as an error message. Return
+    (exit_code, messages). """
+    messages = MessageBuffer()
+    try:
+        exit_code = convert_cli(options, input_file, output_file, stdout,
+                                messages)
+    except Exception as e:
+        messages.write(u"Error: {0}\n".format(e))
+        exit_code = 1
+    return exit_code, messages.getvalue()
+
+
+# Chars which make an input path a glob pattern
+GLOB_CHARS = '*?['
+
+
+def expand_input_paths(input_paths, output_dir=None, output_suffix=None):
+    """ Expand input_paths, each of them is a file, a directory or a glob
+    pattern, return list of input files. Files in a directory (not in its
+    subdirectories) and files matching a pattern are sorted by name. A
+    pattern matching nothing is kept, so that it's reported as failed.
+
+    If output_suffix is given, a file found in a directory or by a pattern is
+    excluded if it's output file of another input file (see gen_output_path),
+    for example output of a previous run.
+    """
+    import glob
+    paths = []  # (path, whether it's found in a directory or by a pattern)
+    for path in input_paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    paths.append((os.path.join(path, name), True))
+        elif not os.path.exists(path) and any(c in path for c in GLOB_CHARS):
+            found = sorted(p for p in glob.glob(path) if os.path.isfile(p))
+            paths.extend((p, True) for p in found)
+            if not found:
+                paths.append((path, False))
+        else:
+            paths.append((path, False))
+    if output_suffix is not None:
+        output_paths = set()
+        for path, _ in paths:
+            output_path = os.path.normpath(
+                gen_output_path(path, output_dir, output_suffix))
+            if output_path != os.path.normpath(path):
+                output_paths.add(output_path)
+        paths = [(path, found) for path, found in paths
+                 if not (found and os.path.normpath(path) in output_paths)]
+    return [path for path, _ in paths]
+
+
+def gen_output_path(input_path, output_dir, output_suffix):
+    """ Return output file of input_path in batch mode, it's input_path with
+    extension replaced by output_suffix, in output_dir if it's not None. """
+    root = os.path.splitext(input_path)[0]
+    if output_dir is not None:
+        root = os.path.join(output_dir, os.path.basename(root))
+    return root + output_suffix
+
+
+def _convert_file_task(task):
+    """ Convert an input file of batch mode in a worker process of pool,
+    return (input_path, exit_code, messages). """
+    options, input_path, output_path = task
+    try:
+        input_file = open(input_path, 'r')
+    except (IOError, OSError) as e:
+        return input_path, 1, u"Error: cannot open {0}: {1}\n".format(
+            input_path, e.strerror)
+    with input_file:
+        exit_code, messages = convert_isolated(options, input_file,
+                                               output_path)
+    return input_path, exit_code, messages
+
+
+def convert_batch(options,
+                  input_paths,
+                  output_dir=None,
+                  output_suffix=None,
+                  stderr=None):
+    """ Convert each input file to an output file in one process, or in a
+    pool of worker processes if options['jobs'] is greater than 1. Format and
+    csv delimiter are guessed for each file if they are not specified. A
+    failed file is reported to stderr and other files are still converted.
+
+    Arguments:
+      options: Options of conversion, see DEFAULT_OPTIONS.
+      input_paths: Files, directories or glob patterns, see
+                   expand_input_paths.
+      output_dir: Directory of output files, it's created if it does not
+                  exist. Output files are put beside input files if it's
+                  None.
+      output_suffix: Output file is name of input file with extension
+                     replaced by output_suffix, '{style}' in it is replaced
+                     by output style. Default is '.txt'.
+      stderr: Stream of messages, default is sys.stderr.
+
+    Returns:
+      Exit code, it's 1 if any option is not valid or any file failed
+    """
+    if stderr is None:
+        stderr = sys.stderr
+    # Options are checked once, rather than reported for each file
+    try:
+        parse_cli_options(options)
+    except ValueError as e:
+        stderr.write("{0}\n".format(e))
+        return 1
+    if output_suffix is None:
+        output_suffix = '.txt'
+    output_suffix = output_suffix.replace('{style}', options['output_style'])
+    paths = expand_input_paths(input_paths, output_dir, output_suffix)
+    jobs = options['jobs']
+    # Html tables of a file are not rendered in a nested pool
+    options = dict(options, jobs=None)
+    tasks = []
+    failed = []
+    used_paths = set(os.path.normpath(path) for path in paths)
+    for path in paths:
+        output_path = gen_output_path(path, output_dir, output_suffix)
+        if os.path.normpath(output_path) in used_paths:
+            # Other files are still converted
+            failed.append(path)
+            stderr.write("{0}: Error: output file {1} conflicts with " \
+                         "another input or output file, skipped.\n".format(
+                             path, output_path))
+            continue
+        used_paths.add(os.path.normpath(output_path))
+        tasks.append((options, path, output_path))
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    pool = None
+    if jobs is not None and jobs > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        chunksize = max(1, min(32, len(tasks) // (jobs * 4)))
+        results = pool.imap(_convert_file_task, tasks, chunksize)
+    else:
+        results = (_convert_file_task(task) for task in tasks)
+    try:
+        for input_path, exit_code, messages in results:
+            if exit_code:
+                failed.append(input_path)
+            for line in iter_lines(messages):
+                # Info of each file (e.g. guessed delimiter) is omitted
+                if exit_code or not line.startswith("Info:"):
+                    stderr.write("{0}: {1}".format(input_path, line))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    stderr.write("Info: converted {0} files, {1} failed.\n".format(
+        len(paths), len(failed)))
+    return 1 if failed else 0
+
+
+# Daemon mode. A request on the unix socket is a line of JSON {"argv": [...]}
+# (command line arguments other than --client, -i and -o, sent by
+# yatg.client), followed by utf-8 input data, the client shuts down writing
+# when all input is sent. The response is a line of JSON {"exit_code": N,
+# "stderr": "..."} followed by utf-8 output table.
+
+
+# sys.stdout and sys.stderr are replaced while argv of a request is parsed,
+# requests are parsed one by one under it
+_PARSE_ARGV_LOCK = threading.Lock()
+
+
+def _to_utf8(data):
+    if isinstance(data, bytes):  # str of Python 2
+        return data
+    return data.encode('utf-8')
+
+
+def parse_client_argv(argv, stdout):
+    """ Parse command line arguments argv sent by yatg.client. Return
+    (options, exit_code, messages), options is None if there is nothing to
+    convert, for example argv is invalid or contains --help or --version. Help
+    is written to binary stream stdout. """
+    help_text = MessageBuffer()
+    messages = MessageBuffer()
+    arg_parser = gen_arg_parser()
+    arg_parser.prog = 'yatg'  # rather than argv[0] of daemon
+    try:
+        with _PARSE_ARGV_LOCK:
+            # argparse writes help and errors to sys.stdout and sys.stderr
+            saved_streams = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = help_text, messages
+            try:
+                args = arg_parser.parse_args(argv)
+            finally:
+                sys.stdout, sys.stderr = saved_streams
+    except SystemExit as e:  # argparse exits for --help and invalid argv
+        return None, e.code or 0, messages.getvalue()
+    finally:
+        stdout.write(_to_utf8(help_text.getvalue()))
+    if args.show_version:
+        return None, 0, __version__
+    if args.input_files or args.output_file is not None or \
+            args.output_dir is not None or args.output_suffix is not None or \
+            args.serve is not None or args.client is not None:
+        return None, 1, "Error: --serve, --output-dir, --output-suffix and " \
+            "multiple input files are not supported by --client.\n"
+    return options_from_args(args), 0, ''
+
+
+def handle_conversion_request(rfile, wfile):
+    """ Read a request from binary stream rfile, convert it as command line
+    tool does, and write response to binary stream wfile. Requests of
+    different connections are converted concurrently. """
+    import json
+    line = rfile.readline()
+    if not line:  # connection is closed without request, e.g. probe of serve
+        return
+    header = json.loads(line.decode('utf-8'))
+    data = rfile.read()
+    if sys.version_info[0] < 3:  # csv module of python 2 only reads bytes
+        input_file = io.BytesIO(data)
     else:
-        sys.stderr.write("Warn: No table is generated, may be your input " \
-                         "data is empty or unnormal.\n")
+        input_file = io.StringIO(data.decode('utf-8'))
+    output = io.BytesIO()
+    options, exit_code, messages = parse_client_argv(header.get('argv', []),
+                                                     output)
+    if options is not None and options['align_in_tty']:
+        options = None
+        exit_code = 1
+        messages = u"Error: option --align-in-tty is not supported by " \
+                   u"daemon, the daemon is not in your tty.\n"
+    if options is not None:
+        exit_code, messages = convert_isolated(options, input_file, None,
+                                               output)
+    response = {'exit_code': exit_code, 'stderr': messages}
+    wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+    wfile.write(output.getvalue())
+    wfile.flush()
+
+
+def gen_conversion_server(socket_path):
+    """ Return a server which handles each conversion request on unix socket
+    socket_path in a thread, call its serve_forever() to start serving. """
+    try:
+        import socketserver
+    except ImportError:  # Python 2
+        import SocketServer as socketserver
+
+    class ConversionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            handle_conversion_request(self.rfile, self.wfile)
+
+    class ConversionServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return ConversionServer(socket_path, ConversionHandler)
+
+
+def serve(socket_path):
+    """ Serve conversions on unix socket socket_path until interrupted or
+    terminated, return exit code. """
+    import signal
+    import socket
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except socket.error:  # nobody listens on it, remove it
+            os.unlink(socket_path)
+        else:
+            sys.stderr.write(
+                "Error: a daemon is serving on {0} already.\n".format(
+                    socket_path))
+            return 1
+        finally:
+            probe.close()
+    server = gen_conversion_server(socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write("Info: serving on {0}\n".format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+    return 0
+
+
+def run_client(argv):
+    """ Run yatg --client with command line arguments argv (same as sys.argv)
+    by the thin client yatg.client, return exit code. """
+    try:
+        from .client import main
+    except (ImportError, ValueError):  # run as script, rather than package
+        from client import main
+    return main(argv)
 
 
 if __name__ == '__main__':